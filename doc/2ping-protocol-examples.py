@@ -28,39 +28,39 @@ def h(input):
 print '### Example 1'
 print
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.message_id = 0x00000000a001
 print '    CLIENT: %s' % h(packet.dump())
 print
 
 print '### Example 2'
 print
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.message_id = 0x00000000a001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+packet.message_id = 0x00000000b001
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a001
 print '    SERVER: %s' % h(packet.dump())
 print
 
 print '### Example 3'
 print
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.message_id = 0x00000000a001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+packet.message_id = 0x00000000b001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a001
 print '    SERVER: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+packet.message_id = 0x00000000a002
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b001
 packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
 packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
 print '    CLIENT: %s' % h(packet.dump())
@@ -69,27 +69,27 @@ print
 print '### Example 4'
 print
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.message_id = 0x00000000a001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+packet.message_id = 0x00000000a002
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a001)
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+packet.message_id = 0x00000000b002
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a002
 packet.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
-packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(0x00000000a001)
 print '    SERVER: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+packet.message_id = 0x00000000a003
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b002
 packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
 packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
 print '    CLIENT: %s' % h(packet.dump())
@@ -98,27 +98,27 @@ print
 print '### Example 5'
 print
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.message_id = 0x00000000a001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+packet.message_id = 0x00000000a002
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a001)
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+packet.message_id = 0x00000000b001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a002
 packet.opcodes[packets.OpcodeInvestigationUnseen.id] = packets.OpcodeInvestigationUnseen()
-packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(0x00000000a001)
 print '    SERVER: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+packet.message_id = 0x00000000a003
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b001
 packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
 packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
 print '    CLIENT: %s' % h(packet.dump())
@@ -127,57 +127,57 @@ print
 print '### Example 6'
 print
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+packet.message_id = 0x00000000a001
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+packet.message_id = 0x00000000a002
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+packet.message_id = 0x00000000a003
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+packet.message_id = 0x00000000b002
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a003
 print '    SERVER: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x04')
+packet.message_id = 0x00000000a004
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b002
 packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
 packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12823
 print '    CLIENT: %s' % h(packet.dump())
 print '    ... etc'
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x0a')
+packet.message_id = 0x00000000a00a
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
-packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x02'))
+packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a001)
+packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a002)
 print '    CLIENT: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x06')
+packet.message_id = 0x00000000b006
 packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x0a')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a00a
 packet.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
-packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(0x00000000a001)
 packet.opcodes[packets.OpcodeInvestigationUnseen.id] = packets.OpcodeInvestigationUnseen()
-packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x02'))
+packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(0x00000000a002)
 packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xb0\x02'))
+packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000b002)
 print '    SERVER: %s' % h(packet.dump())
 packet = packets.Packet()
-packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x0b')
+packet.message_id = 0x00000000a00b
 packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x06')
+packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b006
 packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
 packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 13112
 packet.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
-packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xb0\x02'))
+packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(0x00000000b002)
 print '    CLIENT: %s' % h(packet.dump())
 print
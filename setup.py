@@ -1,13 +1,40 @@
 #!/usr/bin/env python
 
 import os
-from setuptools import setup
+import sys
+from setuptools import setup, Command
 
 
 def read(filename):
     return open(os.path.join(os.path.dirname(__file__), filename)).read()
 
 
+class BenchCommand(Command):
+    description = 'run the codec benchmark'
+    user_options = [
+        ('output=', 'o', 'write the results to this file'),
+        ('compare=', 'c', 'compare against the results in this file'),
+        ('threshold=', 't', 'percent slowdown which counts as a regression'),
+    ]
+
+    def initialize_options(self):
+        self.output = None
+        self.compare = None
+        self.threshold = None
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        from tests import test_benchmark
+        argv = []
+        for opt in ('output', 'compare', 'threshold'):
+            if getattr(self, opt) is not None:
+                argv += ['--%s' % opt, getattr(self, opt)]
+        if test_benchmark.main(argv):
+            sys.exit(1)
+
+
 setup(
     name='2ping',
     description='2ping a bi-directional ping utility',
@@ -30,7 +57,6 @@ setup(
         'Operating System :: Microsoft :: Windows',
         'Operating System :: POSIX',
         'Operating System :: Unix',
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
         'Topic :: Internet',
         'Topic :: System :: Networking',
@@ -43,4 +69,7 @@ setup(
         ],
     },
     test_suite='tests',
+    cmdclass={
+        'bench': BenchCommand,
+    },
 )
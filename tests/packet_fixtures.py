@@ -0,0 +1,111 @@
+# Packet builders shared by the codec and allocation benchmarks.
+
+from twoping import packets
+
+
+def packet_ping():
+    '''A bare ping: the first leg of a 3-way ping'''
+    packet = packets.Packet()
+    packet.message_id = 0x00000000a001
+    packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
+    packet.min_length = 128
+    return packet
+
+
+def packet_reply():
+    '''The second leg of a 3-way ping'''
+    packet = packet_ping()
+    packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
+    packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b001
+    packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
+    packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
+    packet.opcodes[packets.OpcodeHostLatency.id] = packets.OpcodeHostLatency()
+    packet.opcodes[packets.OpcodeHostLatency.id].delay_us = 100
+    return packet
+
+
+def packet_lists():
+    '''A reply carrying long investigation and courtesy lists'''
+    packet = packet_reply()
+    for opcode_class in (
+        packets.OpcodeInvestigate,
+        packets.OpcodeInvestigationSeen,
+        packets.OpcodeCourtesyExpiration,
+    ):
+        packet.opcodes[opcode_class.id] = opcode_class()
+        packet.opcodes[opcode_class.id].message_ids = [0x00000000c000 + x for x in xrange(30)]
+    packet.max_length = 1024
+    return packet
+
+
+def packet_extended():
+    '''A reply carrying every Extended segment 2ping sends'''
+    packet = packet_reply()
+    packet.opcodes[packets.OpcodeExtended.id] = packets.OpcodeExtended()
+    segments = packet.opcodes[packets.OpcodeExtended.id].segments
+    segments[packets.ExtendedVersion.id] = packets.ExtendedVersion()
+    segments[packets.ExtendedVersion.id].text = bytearray(b'2ping test')
+    segments[packets.ExtendedNotice.id] = packets.ExtendedNotice()
+    segments[packets.ExtendedNotice.id].text = bytearray(b'Benchmark notice')
+    segments[packets.ExtendedWallClock.id] = packets.ExtendedWallClock()
+    segments[packets.ExtendedWallClock.id].time_us = 1454187789993266
+    segments[packets.ExtendedMonotonicClock.id] = packets.ExtendedMonotonicClock()
+    segments[packets.ExtendedMonotonicClock.id].generation = 9311
+    segments[packets.ExtendedMonotonicClock.id].time_us = 1454187789993266
+    segments[packets.ExtendedRandom.id] = packets.ExtendedRandom()
+    segments[packets.ExtendedRandom.id].is_os = True
+    segments[packets.ExtendedRandom.id].random_data = bytearray(range(32))
+    return packet
+
+
+def packet_hmac(digest_index):
+    packet = packet_reply()
+    packet.opcodes[packets.OpcodeHMAC.id] = packets.OpcodeHMAC()
+    packet.opcodes[packets.OpcodeHMAC.id].key = bytearray(b'Secret key')
+    packet.opcodes[packets.OpcodeHMAC.id].digest_index = digest_index
+    return packet
+
+
+def reference_packet():
+    '''A typical reply, with a courtesy expiration and Extended segments'''
+    packet = packet_reply()
+    packet.opcodes[packets.OpcodeCourtesyExpiration.id] = packets.OpcodeCourtesyExpiration()
+    packet.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids = [
+        0x00000000a000,
+    ]
+    packet.opcodes[packets.OpcodeExtended.id] = packets.OpcodeExtended()
+    segments = packet.opcodes[packets.OpcodeExtended.id].segments
+    segments[packets.ExtendedVersion.id] = packets.ExtendedVersion()
+    segments[packets.ExtendedVersion.id].text = bytearray(b'2ping test')
+    segments[packets.ExtendedMonotonicClock.id] = packets.ExtendedMonotonicClock()
+    segments[packets.ExtendedMonotonicClock.id].generation = 9311
+    segments[packets.ExtendedMonotonicClock.id].time_us = 1454187789993266
+    return packet
+
+
+def packet_cases():
+    '''Return a list of (name, packet) cases'''
+    cases = [
+        ('ping', packet_ping()),
+        ('reply', packet_reply()),
+        ('lists', packet_lists()),
+        ('extended', packet_extended()),
+    ]
+    for digest_index in sorted(packets.OpcodeHMAC.digest_map.keys()):
+        cases.append(('hmac%d' % digest_index, packet_hmac(digest_index)))
+    return cases
+
+
+def load_lazy(data):
+    packet = packets.Packet()
+    packet.load(data)
+    return packet
+
+
+def load_all(data):
+    packet = load_lazy(data)
+    # Decode everything, as a caller looking at each opcode would.
+    for opcode in packet.opcodes.values():
+        if isinstance(opcode, packets.OpcodeExtended):
+            opcode.segments.values()
+    return packet
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+from StringIO import StringIO
+from twoping import cli
+from twoping.args import parse_args
+
+
+@unittest.skipUnless(cli.has_asyncio, 'asyncio not available')
+class TestAsyncioEngine(unittest.TestCase):
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_embedded(self):
+        # A listener and a client sharing one event loop.
+        loop = cli.asyncio_engine.new_event_loop()
+        listener = cli.TwoPing(parse_args(['2ping', '--listen', '-I', '127.0.0.1', '--port', '0', '-q']))
+        listener.setup_listener()
+        port = listener.sock_classes[0].sock.getsockname()[1]
+        client = cli.TwoPing(parse_args(['2ping', '127.0.0.1', '--port', str(port), '-c', '3', '-i', '0.05', '-q']))
+        client.setup_client()
+
+        listener_engine = cli.asyncio_engine.AsyncioEngine(listener, loop)
+        client_engine = cli.asyncio_engine.AsyncioEngine(client, loop)
+        listener_engine.start()
+        client_engine.start()
+        try:
+            self.assertEqual(loop.run_until_complete(client_engine.finished), 0)
+        finally:
+            listener_engine.stop()
+            loop.close()
+        self.assertEqual(client.sock_classes[0].pings_transmitted, 3)
+        self.assertEqual(client.sock_classes[0].pings_received, 3)
+        self.assertEqual(listener.pings_transmitted, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import unittest
+import errno
+import os
+import shutil
+import socket
+import select
+import tempfile
+import threading
+import time
+from twoping import batch_io
+from twoping import cli
+from twoping.args import parse_args
+
+
+class TestBatchIO(unittest.TestCase):
+    def setUp(self):
+        self.rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rx.bind(('127.0.0.1', 0))
+        self.tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.tx.bind(('127.0.0.1', 0))
+
+    def tearDown(self):
+        self.rx.close()
+        self.tx.close()
+
+    def exchange(self, io, count):
+        datagrams = [(bytearray([i]) * (i + 1), self.rx.getsockname()) for i in range(count)]
+        self.assertEqual(io.send(self.tx, datagrams), [])
+        received = []
+        while len(received) < count:
+            select.select([self.rx], [], [], 1.0)
+            received += io.recv(self.rx)
+        self.assertEqual([x[0][:x[1]] for x in received], [x[0] for x in datagrams])
+        for (buf, length, address) in received:
+            self.assertEqual(address, self.tx.getsockname())
+            io.release(buf)
+
+    def test_simple(self):
+        self.exchange(batch_io.SimpleBatchIO(), 3)
+
+    def test_best(self):
+        io = batch_io.best_batch_io(4)
+        self.assertTrue(isinstance(io, (batch_io.MmsgBatchIO, batch_io.SimpleBatchIO)))
+        self.exchange(io, 10)
+
+    def test_best_single(self):
+        self.assertTrue(isinstance(batch_io.best_batch_io(1), batch_io.SimpleBatchIO))
+
+    def test_pool(self):
+        pool = batch_io.BufferPool(16, 1)
+        buf = pool.get()
+        self.assertEqual(len(buf), 16)
+        self.assertFalse(pool.get() is buf)
+        pool.put(buf)
+        self.assertTrue(pool.get() is buf)
+
+    def test_recv_empty(self):
+        self.rx.setblocking(False)
+        self.assertEqual(batch_io.SimpleBatchIO().recv(self.rx), [])
+        self.assertEqual(batch_io.best_batch_io(4).recv(self.rx), [])
+
+    def test_send_error(self):
+        io = batch_io.best_batch_io(4)
+        errors = io.send(self.tx, [(bytearray(1), ('127.0.0.1', 0))])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], ('127.0.0.1', 0))
+
+    def test_mmsg_sent_nothing(self):
+        # sendmmsg() returning 0 must not stall the send loop.
+        try:
+            io = batch_io.MmsgBatchIO(4)
+        except (AttributeError, OSError):
+            self.skipTest('sendmmsg not available')
+        sendmmsg = io.sendmmsg
+        calls = []
+
+        def sent_nothing(*args):
+            calls.append(args[2])
+            if len(calls) == 1:
+                return 0
+            return sendmmsg(*args)
+        io.sendmmsg = sent_nothing
+        datagrams = [(bytearray([i]), self.rx.getsockname()) for i in range(3)]
+        errors = io.send(self.tx, datagrams)
+        self.assertEqual([address for (address, e) in errors], [self.rx.getsockname()])
+        self.assertEqual(calls, [3, 2])
+        received = []
+        while len(received) < 2:
+            select.select([self.rx], [], [], 1.0)
+            received += io.recv(self.rx)
+        self.assertEqual([x[0][:x[1]] for x in received], [bytearray([1]), bytearray([2])])
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'AF_UNIX not available')
+class TestFullSendBuffer(unittest.TestCase):
+    '''Sends into a full buffer wait for room instead of failing'''
+
+    def setUp(self):
+        # A non-blocking sender gets EAGAIN once a Unix datagram
+        # receiver's queue is full, which UDP over loopback never does.
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'rx')
+        self.rx = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(self.rx.close)
+        self.rx.bind(self.path)
+        self.tx = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(self.tx.close)
+        self.tx.setblocking(False)
+        self.queued = 0
+        while True:
+            try:
+                self.tx.sendto(b'x', self.path)
+            except socket.error as e:
+                self.assertIn(e.args[0], (errno.EAGAIN, errno.EWOULDBLOCK))
+                break
+            self.queued += 1
+
+    def drain_later(self):
+        def drain():
+            time.sleep(0.2)
+            for i in range(self.queued):
+                self.rx.recv(16)
+        thread = threading.Thread(target=drain)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_sendto(self):
+        self.drain_later()
+        self.assertEqual(batch_io.sendto(self.tx, b'ping', self.path), 4)
+        # The socket is left non-blocking.
+        self.assertEqual(self.tx.gettimeout(), 0.0)
+
+    def test_simple(self):
+        self.drain_later()
+        self.assertEqual(batch_io.SimpleBatchIO().send(self.tx, [(b'ping', self.path)]), [])
+        self.assertEqual(self.tx.gettimeout(), 0.0)
+
+    def test_sock_sendto(self):
+        t = cli.TwoPing(parse_args(['2ping', '--listen', '-q']))
+        sock_class = cli.SocketClass(self.tx)
+        self.drain_later()
+        t.sock_sendto(sock_class, b'ping', self.path)
+        self.assertEqual(t.errors_received, 0)
+        self.assertEqual(sock_class.errors_received, 0)
+
+    def test_mmsg(self):
+        # sendmmsg() cannot address a Unix socket, so a full buffer is
+        # simulated by failing the first call with EAGAIN.
+        try:
+            io = batch_io.MmsgBatchIO(4)
+        except (AttributeError, OSError):
+            self.skipTest('sendmmsg not available')
+        rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(rx.close)
+        rx.bind(('127.0.0.1', 0))
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(tx.close)
+        tx.setblocking(False)
+        sendmmsg = io.sendmmsg
+        calls = []
+
+        def full_sendmmsg(*args):
+            calls.append(tx.gettimeout())
+            if len(calls) == 1:
+                io.ctypes.set_errno(errno.EAGAIN)
+                return -1
+            return sendmmsg(*args)
+        io.sendmmsg = full_sendmmsg
+        self.assertEqual(io.send(tx, [(b'ping', rx.getsockname())]), [])
+        self.assertEqual(calls, [0.0, None])
+        self.assertEqual(tx.gettimeout(), 0.0)
+        select.select([rx], [], [], 1.0)
+        self.assertEqual(rx.recv(16), b'ping')
+
+
+if __name__ == '__main__':
+    unittest.main()
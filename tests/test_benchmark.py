@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# Codec throughput benchmark.  Run directly (or "make bench") to time
+# each case and print the results as JSON:
+#
+#     python -m tests.test_benchmark [--output FILE] [--compare BASELINE]
+#
+# With --compare, cases which are slower than in BASELINE (a previous
+# --output) by more than --threshold percent are reported, and the exit
+# status is 1 if there are any.
+
+from __future__ import print_function, division
+import argparse
+import json
+import sys
+import timeit
+import unittest
+from twoping import packets
+from twoping import checksum
+from twoping import crc32
+from tests.packet_fixtures import packet_cases, load_all
+
+
+def verify_packet(data, key, digest_index):
+    packet = packets.Packet()
+    packet.load(data)
+    (pos, length) = packet.opcode_data_positions[packets.OpcodeHMAC.id]
+    return packets.verify_hash(key, digest_index, data, pos + 2, pos + length)
+
+
+def benchmarks():
+    '''Return a list of (name, function) cases'''
+    cases = []
+    for (name, packet) in packet_cases():
+        data = packet.dump()
+        cases.append(('dump_%s' % name, packet.dump))
+        cases.append(('load_%s' % name, lambda data=data: load_all(data)))
+        if packets.OpcodeHMAC.id in packet.opcodes:
+            opcode = packet.opcodes[packets.OpcodeHMAC.id]
+            cases.append(('verify_%s' % name, lambda data=data, opcode=opcode: verify_packet(
+                data, opcode.key, opcode.digest_index,
+            )))
+    for size in (128, 1024):
+        data = bytearray(x & 0xff for x in xrange(size))
+        cases.append(('checksum_%d' % size, lambda data=data: checksum.twoping_checksum(data)))
+        cases.append(('crc32_%d' % size, lambda data=data: crc32.new(data).digest()))
+    return cases
+
+
+def run(cases, min_time=0.2, repeat=3):
+    '''Time each case, returning {name: {"us_per_op": ..., "ops_per_sec": ...}}
+
+    Each case is run in batches sized to take at least min_time, and the
+    best of repeat batches is kept.
+    '''
+    results = {}
+    for (name, func) in cases:
+        timer = timeit.Timer(func)
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 2
+        best = min(timer.repeat(repeat, number)) / number
+        results[name] = {
+            'us_per_op': best * 1000000,
+            'ops_per_sec': 1 / best,
+        }
+    return results
+
+
+def compare(results, baseline, threshold=10.0):
+    '''Return (name, baseline us, current us, percent slower) for each regression'''
+    regressions = []
+    for name in sorted(results.keys()):
+        if name not in baseline:
+            continue
+        old = baseline[name]['us_per_op']
+        new = results[name]['us_per_op']
+        slower = (new - old) / old * 100
+        if slower > threshold:
+            regressions.append((name, old, new, slower))
+    return regressions
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_cases(self):
+        # Every case must at least run, and the packets must load back.
+        for (name, func) in benchmarks():
+            func()
+        for (name, packet) in packet_cases():
+            packet_in = load_all(packet.dump())
+            self.assertEqual(packet_in.message_id, packet.message_id)
+            self.assertEqual(sorted(packet_in.opcodes.keys()), sorted(packet.opcodes.keys()))
+
+    def test_verify(self):
+        for (name, packet) in packet_cases():
+            if packets.OpcodeHMAC.id not in packet.opcodes:
+                continue
+            opcode = packet.opcodes[packets.OpcodeHMAC.id]
+            (valid, calculated) = verify_packet(packet.dump(), opcode.key, opcode.digest_index)
+            self.assertTrue(valid)
+
+    def test_compare(self):
+        baseline = {
+            'a': {'us_per_op': 10.0, 'ops_per_sec': 100000.0},
+            'b': {'us_per_op': 10.0, 'ops_per_sec': 100000.0},
+        }
+        results = {
+            'a': {'us_per_op': 10.5, 'ops_per_sec': 95238.0},
+            'b': {'us_per_op': 12.0, 'ops_per_sec': 83333.0},
+            'c': {'us_per_op': 50.0, 'ops_per_sec': 20000.0},
+        }
+        self.assertEqual(compare(results, baseline), [('b', 10.0, 12.0, 20.0)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='2ping codec benchmark')
+    parser.add_argument('--output', '-o', help='write the results to this file instead of stdout')
+    parser.add_argument('--compare', '-c', help='compare against the results in this file')
+    parser.add_argument(
+        '--threshold', '-t', type=float, default=10.0,
+        help='percent slowdown against --compare which counts as a regression',
+    )
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per timed batch')
+    parser.add_argument('--filter', '-f', help='only run cases whose names contain this')
+    args = parser.parse_args(argv)
+
+    cases = benchmarks()
+    if args.filter:
+        cases = [(name, func) for (name, func) in cases if args.filter in name]
+    results = run(cases, min_time=args.min_time)
+
+    out = json.dumps(results, indent=2, sort_keys=True, separators=(',', ': '))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        print(out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for (name, old, new, slower) in regressions:
+            print('%s: %.2f us -> %.2f us (%.1f%% slower)' % (name, old, new, slower), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
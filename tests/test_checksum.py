@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import unittest
+import random
+from twoping import checksum
+
+
+def bytewise_checksum(d):
+    checksum = 0
+    for i in range(len(d)):
+        if i & 1:
+            checksum += d[i]
+        else:
+            checksum += d[i] << 8
+    checksum = ((checksum >> 16) + (checksum & 0xffff))
+    checksum = ((checksum >> 16) + (checksum & 0xffff))
+    checksum = ~checksum & 0xffff
+    if checksum == 0:
+        checksum = 0xffff
+    return checksum
+
+
+class TestChecksum(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(2016)
+
+    def random_data(self, length):
+        return bytearray([self.random.randint(0, 255) for x in range(length)])
+
+    def test_bytewise(self):
+        for length in list(range(0, 20)) + [511, 512, 1024, 16383]:
+            data = self.random_data(length)
+            self.assertEqual(checksum.twoping_checksum(data), bytewise_checksum(data))
+
+    def test_zero(self):
+        self.assertEqual(checksum.twoping_checksum(bytearray(16)), 0xffff)
+        self.assertEqual(checksum.twoping_checksum(bytearray(b'\xff\xff')), 0xffff)
+
+    def test_memoryview(self):
+        data = self.random_data(129)
+        self.assertEqual(checksum.twoping_checksum(memoryview(data)), bytewise_checksum(data))
+
+    def test_word_sum_offset(self):
+        data = self.random_data(128)
+        for begin in range(0, 8):
+            for end in range(begin, 16):
+                total = (
+                    checksum.word_sum(data[0:begin]) +
+                    checksum.word_sum(data[begin:end], begin) +
+                    checksum.word_sum(data[end:], end)
+                )
+                self.assertEqual(checksum.finish(total), bytewise_checksum(data))
+
+    def test_update(self):
+        data = self.random_data(128)
+        data_checksum = bytewise_checksum(data)
+        for i in range(200):
+            begin = self.random.randint(0, 120)
+            end = self.random.randint(begin, 128)
+            new_data = self.random_data(end - begin)
+            data_checksum = checksum.update(data_checksum, begin, data[begin:end], new_data)
+            data[begin:end] = new_data
+            self.assertEqual(data_checksum, bytewise_checksum(data))
+
+    def test_update_to_zero(self):
+        data = bytearray(b'\x12\x34\x56\x78')
+        data_checksum = checksum.update(bytewise_checksum(data), 0, data, bytearray(4))
+        self.assertEqual(data_checksum, 0xffff)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import unittest
+from twoping import codec
+
+
+class TestCodec(unittest.TestCase):
+    def test_uint16(self):
+        self.assertEqual(codec.pack_uint16(0x1234), bytearray(b'\x12\x34'))
+        self.assertEqual(codec.unpack_uint16(bytearray(b'\x12\x34')), 0x1234)
+
+    def test_uint32(self):
+        self.assertEqual(codec.pack_uint32(0x12345678), bytearray(b'\x12\x34\x56\x78'))
+        self.assertEqual(codec.unpack_uint32(bytearray(b'\x12\x34\x56\x78')), 0x12345678)
+
+    def test_uint48(self):
+        self.assertEqual(codec.pack_uint48(0x123456789abc), bytearray(b'\x12\x34\x56\x78\x9a\xbc'))
+        self.assertEqual(codec.unpack_uint48(bytearray(b'\x12\x34\x56\x78\x9a\xbc')), 0x123456789abc)
+        self.assertEqual(codec.pack_uint48(1), bytearray(b'\x00\x00\x00\x00\x00\x01'))
+
+    def test_uint64(self):
+        self.assertEqual(codec.pack_uint64(0x123456789abcdef0), bytearray(b'\x12\x34\x56\x78\x9a\xbc\xde\xf0'))
+        self.assertEqual(codec.unpack_uint64(bytearray(b'\x12\x34\x56\x78\x9a\xbc\xde\xf0')), 0x123456789abcdef0)
+
+    def test_into(self):
+        buf = bytearray(10)
+        codec.pack_uint48_into(buf, 2, 0x123456789abc)
+        codec.pack_uint16_into(buf, 8, 0xffff)
+        self.assertEqual(buf, bytearray(b'\x00\x00\x12\x34\x56\x78\x9a\xbc\xff\xff'))
+        self.assertEqual(codec.unpack_uint48(memoryview(buf), 2), 0x123456789abc)
+
+    def test_partial(self):
+        buf = bytearray(b'\x12\x34\x56\x78')
+        self.assertEqual(codec.unpack_partial(codec.unpack_uint32, buf, 0, 4), 0x12345678)
+        self.assertEqual(codec.unpack_partial(codec.unpack_uint32, memoryview(buf)[:2], 0, 4), 0x1234)
+        self.assertEqual(codec.unpack_partial(codec.unpack_uint16, buf, 3, 2), 0x78)
+        self.assertEqual(codec.unpack_partial(codec.unpack_uint16, buf, 4, 2), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import unittest
+from twoping import fuzz
+from twoping import utils
+
+
+class TestFuzz(unittest.TestCase):
+    def test_seed_replay(self):
+        outs = []
+        for i in range(2):
+            fuzzer = fuzz.Fuzzer(1234)
+            outs.append([fuzzer.fuzz_packet(bytearray(128), 0.05) for j in range(5)])
+        self.assertEqual(outs[0], outs[1])
+        self.assertNotEqual(outs[0][0], outs[0][1])
+
+    def test_fraction_zero(self):
+        data = bytearray(b'abcdefgh')
+        fuzz.Fuzzer(0).fuzz_bits(data, 0)
+        self.assertEqual(data, bytearray(b'abcdefgh'))
+
+    def test_fraction_one(self):
+        data = bytearray(b'\x00\x0f\xff\x00')
+        fuzz.Fuzzer(0).fuzz_bits(data, 1.0, 1, 3)
+        self.assertEqual(data, bytearray(b'\x00\xf0\x00\x00'))
+
+    def test_fraction_tiny(self):
+        # 1 - fraction rounds to 1.0, and the gap to the first flip
+        # overflows a float.
+        for fraction in (1e-17, 5e-324):
+            data = bytearray(b'abcdefgh')
+            fuzz.Fuzzer(0).fuzz_packet(data, fraction)
+            self.assertEqual(data[4:], bytearray(b'efgh'))
+
+    def test_range(self):
+        data = bytearray(16)
+        fuzz.Fuzzer(0).fuzz_bits(data, 0.5, 4, 8)
+        self.assertEqual(data[0:4], bytearray(4))
+        self.assertEqual(data[8:], bytearray(8))
+
+    def test_rate(self):
+        data = bytearray(10000)
+        fuzz.Fuzzer(0).fuzz_bits(data, 0.01)
+        flipped = sum(bin(x).count('1') for x in data)
+        self.assertTrue(600 < flipped < 1000)
+
+    def test_checksum(self):
+        packet = fuzz.Fuzzer(0).fuzz_packet(bytearray(64), 0)
+        self.assertEqual(packet[2:4], bytearray(b'\xff\xff'))
+        packet[2:4] = bytearray(2)
+        self.assertEqual(utils.twoping_checksum(packet), 0xffff)
+
+
+if __name__ == '__main__':
+    unittest.main()
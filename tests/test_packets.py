@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import unittest
+import hmac
 from twoping import packets
 
 
@@ -34,28 +35,34 @@ class TestPacketsOpcodes(unittest.TestCase):
         self.assertEqual(opcode.dump(), data)
 
     def test_opcode_investigation_seen(self):
-        data = bytearray(b'\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
+        data = bytearray(b'\x00\x02\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
         opcode = packets.OpcodeInvestigationSeen()
         opcode.load(data)
         self.assertEqual(opcode.id, 0x0008)
         self.assertEqual(opcode.dump(), data)
 
     def test_opcode_investigation_unseen(self):
-        data = bytearray(b'\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
+        data = bytearray(b'\x00\x02\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
         opcode = packets.OpcodeInvestigationUnseen()
         opcode.load(data)
         self.assertEqual(opcode.id, 0x0010)
         self.assertEqual(opcode.dump(), data)
 
     def test_opcode_investigate(self):
-        data = bytearray(b'\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
+        data = bytearray(b'\x00\x02\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
         opcode = packets.OpcodeInvestigate()
         opcode.load(data)
         self.assertEqual(opcode.id, 0x0020)
         self.assertEqual(opcode.dump(), data)
+        self.assertEqual(opcode.message_ids, [0x010203040506, 0x111213141516])
+
+    def test_opcode_investigate_truncated(self):
+        opcode = packets.OpcodeInvestigate()
+        opcode.load(bytearray(b'\x00\x03\x01\x02\x03\x04\x05\x06\x11\x12'))
+        self.assertEqual(opcode.message_ids, [0x010203040506])
 
     def test_opcode_courtesy_expiration(self):
-        data = bytearray(b'\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
+        data = bytearray(b'\x00\x02\x01\x02\x03\x04\x05\x06\x11\x12\x13\x14\x15\x16')
         opcode = packets.OpcodeCourtesyExpiration()
         opcode.load(data)
         self.assertEqual(opcode.id, 0x0040)
@@ -157,180 +164,547 @@ class TestPacketsReference(unittest.TestCase):
     '''
     def test_reference_1a(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.message_id = 0x00000000a001
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xae\x00\x00\x00\x00\xa0\x01\x00\x00'))
 
     def test_reference_2a(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.message_id = 0x00000000a001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xad\x00\x00\x00\x00\xa0\x01\x00\x01\x00\x00'))
 
     def test_reference_2b(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+        packet.message_id = 0x00000000b001
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a001
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x7d\xa4\x00\x00\x00\x00\xb0\x01\x00\x02\x00\x06\x00\x00\x00\x00\xa0\x01'))
 
     def test_reference_3a(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.message_id = 0x00000000a001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xad\x00\x00\x00\x00\xa0\x01\x00\x01\x00\x00'))
 
     def test_reference_3b(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+        packet.message_id = 0x00000000b001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a001
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x7d\xa3\x00\x00\x00\x00\xb0\x01\x00\x03\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x01'))
 
     def test_reference_3c(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+        packet.message_id = 0x00000000a002
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b001
         packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
         packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x4d\x62\x00\x00\x00\x00\xa0\x02\x00\x06\x00\x06\x00\x00\x00\x00\xb0\x01\x00\x04\x00\x00\x30\x39'))
 
     def test_reference_4a(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.message_id = 0x00000000a001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xad\x00\x00\x00\x00\xa0\x01\x00\x01\x00\x00'))
 
     def test_reference_4b(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+        packet.message_id = 0x00000000a002
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a001)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x8d\x81\x00\x00\x00\x00\xa0\x02\x00\x21\x00\x00\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01'))
 
     def test_reference_4c(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+        packet.message_id = 0x00000000b002
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a002
         packet.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
-        packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+        packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(0x00000000a001)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\xdd\x8e\x00\x00\x00\x00\xb0\x02\x00\x0b\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x02\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01'))
 
     def test_reference_4d(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+        packet.message_id = 0x00000000a003
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b002
         packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
         packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x4d\x60\x00\x00\x00\x00\xa0\x03\x00\x06\x00\x06\x00\x00\x00\x00\xb0\x02\x00\x04\x00\x00\x30\x39'))
 
     def test_reference_5a(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.message_id = 0x00000000a001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xad\x00\x00\x00\x00\xa0\x01\x00\x01\x00\x00'))
 
     def test_reference_5b(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+        packet.message_id = 0x00000000a002
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a001)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x8d\x81\x00\x00\x00\x00\xa0\x02\x00\x21\x00\x00\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01'))
 
     def test_reference_5c(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+        packet.message_id = 0x00000000b001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a002
         packet.opcodes[packets.OpcodeInvestigationUnseen.id] = packets.OpcodeInvestigationUnseen()
-        packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+        packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(0x00000000a001)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\xdd\x87\x00\x00\x00\x00\xb0\x01\x00\x13\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x02\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01'))
 
     def test_reference_5d(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+        packet.message_id = 0x00000000a003
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x01')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b001
         packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
         packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x4d\x61\x00\x00\x00\x00\xa0\x03\x00\x06\x00\x06\x00\x00\x00\x00\xb0\x01\x00\x04\x00\x00\x30\x39'))
 
     def test_reference_6a(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x01')
+        packet.message_id = 0x00000000a001
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xad\x00\x00\x00\x00\xa0\x01\x00\x01\x00\x00'))
 
     def test_reference_6b(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x02')
+        packet.message_id = 0x00000000a002
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xac\x00\x00\x00\x00\xa0\x02\x00\x01\x00\x00'))
 
     def test_reference_6c(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+        packet.message_id = 0x00000000a003
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x2d\xab\x00\x00\x00\x00\xa0\x03\x00\x01\x00\x00'))
 
     def test_reference_6d(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+        packet.message_id = 0x00000000b002
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x03')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a003
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x7d\xa0\x00\x00\x00\x00\xb0\x02\x00\x03\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x03'))
 
     def test_reference_6e(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x04')
+        packet.message_id = 0x00000000a004
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x02')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b002
         packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
         packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12823
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x4b\x81\x00\x00\x00\x00\xa0\x04\x00\x06\x00\x06\x00\x00\x00\x00\xb0\x02\x00\x04\x00\x00\x32\x17'))
 
     def test_reference_6f(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x0a')
+        packet.message_id = 0x00000000a00a
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
-        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x02'))
+        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a001)
+        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000a002)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\xed\x6f\x00\x00\x00\x00\xa0\x0a\x00\x21\x00\x00\x00\x0e\x00\x02\x00\x00\x00\x00\xa0\x01\x00\x00\x00\x00\xa0\x02'))
 
     def test_reference_6g(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xb0\x06')
+        packet.message_id = 0x00000000b006
         packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xa0\x0a')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000a00a
         packet.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
-        packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x01'))
+        packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(0x00000000a001)
         packet.opcodes[packets.OpcodeInvestigationUnseen.id] = packets.OpcodeInvestigationUnseen()
-        packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xa0\x02'))
+        packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids.append(0x00000000a002)
         packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
-        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(bytearray('\x00\x00\x00\x00\xb0\x02'))
+        packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000b002)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x8d\x3b\x00\x00\x00\x00\xb0\x06\x00\x3b\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x0a\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x02\x00\x08\x00\x01\x00\x00\x00\x00\xb0\x02'))
 
     def test_reference_6h(self):
         packet = packets.Packet()
-        packet.message_id = bytearray('\x00\x00\x00\x00\xa0\x0b')
+        packet.message_id = 0x00000000a00b
         packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
-        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = bytearray('\x00\x00\x00\x00\xb0\x06')
+        packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b006
         packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
         packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 13112
         packet.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
-        packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(bytearray('\x00\x00\x00\x00\xb0\x02'))
+        packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(0x00000000b002)
         self.assertEqual(packet.dump(), bytearray(b'\x32\x50\x9a\x41\x00\x00\x00\x00\xa0\x0b\x00\x0e\x00\x06\x00\x00\x00\x00\xb0\x06\x00\x04\x00\x00\x33\x38\x00\x08\x00\x01\x00\x00\x00\x00\xb0\x02'))
 
 
+
+class TestPacketsLoad(unittest.TestCase):
+    def test_load_reference_6g(self):
+        packet = packets.Packet()
+        packet.load(bytearray(b'\x32\x50\x8d\x3b\x00\x00\x00\x00\xb0\x06\x00\x3b\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x0a\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x02\x00\x08\x00\x01\x00\x00\x00\x00\xb0\x02'))
+        self.assertEqual(packet.message_id, 0x00000000b006)
+        self.assertEqual(sorted(packet.opcodes.keys()), [0x0001, 0x0002, 0x0008, 0x0010, 0x0020])
+        self.assertEqual(packet.opcodes[packets.OpcodeInReplyTo.id].message_id, 0x00000000a00a)
+        self.assertEqual(packet.opcodes[packets.OpcodeInvestigationSeen.id].message_ids, [0x00000000a001])
+        self.assertEqual(packet.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids, [0x00000000a002])
+        self.assertEqual(packet.opcodes[packets.OpcodeInvestigate.id].message_ids, [0x00000000b002])
+        self.assertEqual(packet.opcode_data_positions[packets.OpcodeInReplyTo.id], (16, 6))
+
+    def test_load_roundtrip(self):
+        packet = packets.Packet()
+        packet.message_id = 0x00000000a001
+        packet.opcodes[packets.OpcodeRTTEnclosed.id] = packets.OpcodeRTTEnclosed()
+        packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us = 12345
+        packet.opcodes[packets.OpcodeExtended.id] = packets.OpcodeExtended()
+        packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id] = packets.ExtendedMonotonicClock()
+        packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id].generation = 9311
+        packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id].time_us = 1454187789993266
+        packet.min_length = 128
+        packet_in = packets.Packet()
+        packet_in.load(packet.dump())
+        self.assertEqual(packet_in.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us, 12345)
+        segment = packet_in.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id]
+        self.assertEqual(segment.generation, 9311)
+        self.assertEqual(segment.time_us, 1454187789993266)
+
+    def test_load_invalid_checksum(self):
+        packet = packets.Packet()
+        self.assertRaises(Exception, packet.load, bytearray(b'\x32\x50\x2d\xad\x00\x00\x00\x00\xa0\x01\x00\x00'))
+
+    def test_load_truncated(self):
+        packet = packets.Packet()
+        self.assertRaises(Exception, packet.load, bytearray(b'\x32\x50\x00\x00\x00\x00\x00\x00\xa0\x01\x00\x21\x00'))
+
+    def test_load_lazy(self):
+        packet = packets.Packet()
+        packet.load(bytearray(b'\x32\x50\x8d\x3b\x00\x00\x00\x00\xb0\x06\x00\x3b\x00\x00\x00\x06\x00\x00\x00\x00\xa0\x0a\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x01\x00\x08\x00\x01\x00\x00\x00\x00\xa0\x02\x00\x08\x00\x01\x00\x00\x00\x00\xb0\x02'))
+        self.assertEqual(len(packet.opcodes.pending), 5)
+        self.assertTrue(packets.OpcodeInReplyTo.id in packet.opcodes)
+        self.assertFalse(packets.OpcodeHMAC.id in packet.opcodes)
+        self.assertEqual(len(packet.opcodes.pending), 5)
+        packet.opcodes[packets.OpcodeInReplyTo.id]
+        self.assertEqual(len(packet.opcodes.pending), 4)
+        self.assertEqual(len(packet.opcodes), 5)
+        repr(packet)
+        self.assertEqual(len(packet.opcodes.pending), 0)
+
+    def test_load_truncated_opcode_data(self):
+        packet = packets.Packet()
+        self.assertRaises(Exception, packet.load, bytearray(b'\x32\x50\x2d\xa6\x00\x00\x00\x00\xa0\x01\x00\x02\x00\x06\x00\x00'))
+
+    def test_load_short_opcode(self):
+        # A 2-byte RTT Enclosed opcode is accepted, and decodes to what is
+        # there rather than raising when it is first looked up.
+        packet = packets.Packet()
+        packet.load(bytearray(b'\x32\x50\x00\x00\x00\x00\x00\x00\xa0\x01\x00\x04\x00\x02\x01\x02'))
+        self.assertEqual(packet.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us, 0x0102)
+
+    def test_load_short_opcodes(self):
+        # Every fixed-width field decodes when cut short, down to no data.
+        for opcode_class in (
+            packets.OpcodeInReplyTo, packets.OpcodeRTTEnclosed, packets.OpcodeInvestigate,
+            packets.OpcodeHMAC, packets.OpcodeHostLatency,
+        ):
+            for length in range(3):
+                opcode = packets.load_opcode(opcode_class.id, memoryview(bytearray(b'\x01\x02'))[:length])
+                self.assertEqual(opcode.__class__, opcode_class)
+        for segment_class in (packets.ExtendedWallClock, packets.ExtendedMonotonicClock, packets.ExtendedRandom):
+            for length in range(3):
+                segment = packets.load_segment(segment_class.id, memoryview(bytearray(b'\x01\x02'))[:length])
+                self.assertEqual(segment.__class__, segment_class)
+        segment = packets.load_segment(packets.ExtendedMonotonicClock.id, memoryview(bytearray(b'\x00\x05\x01\x02')))
+        self.assertEqual((segment.generation, segment.time_us), (5, 0x0102))
+
+    def test_load_short_extended(self):
+        # The last segment's data is cut short and followed by a partial
+        # header.
+        opcode = packets.OpcodeExtended()
+        opcode.load(bytearray(b'\x77\x1d\x8d\xfb\x00\x0a\x00\x05\x01\x02'))
+        self.assertEqual(opcode.segments[packets.ExtendedMonotonicClock.id].time_us, 0x0102)
+        opcode.load(bytearray(b'\x77\x1d\x8d\xfb\x00\x02\x00\x05\x12\x34'))
+        self.assertEqual(list(opcode.segments.keys()), [packets.ExtendedMonotonicClock.id])
+
+
+class TestLazyMap(unittest.TestCase):
+    def setUp(self):
+        self.decoded = []
+
+        def decoder(key, view):
+            self.decoded.append(key)
+            return bytes(view)
+        self.lazy = packets.LazyMap(bytearray(b'aabbcc'), {1: (0, 2), 2: (2, 2), 3: (4, 2)}, decoder)
+        self.expected = {1: b'aa', 2: b'bb', 3: b'cc'}
+
+    def test_lookup(self):
+        self.assertTrue(2 in self.lazy)
+        self.assertFalse(4 in self.lazy)
+        self.assertEqual(self.decoded, [])
+        self.assertEqual(self.lazy[2], b'bb')
+        self.assertEqual(self.lazy.get(2), b'bb')
+        self.assertEqual(self.lazy.get(4, b'zz'), b'zz')
+        self.assertRaises(KeyError, self.lazy.__getitem__, 4)
+        self.assertEqual(self.decoded, [2])
+        self.assertEqual(len(self.lazy), 3)
+
+    def test_dict(self):
+        self.lazy[1]
+        self.assertEqual(dict(self.lazy), self.expected)
+        self.assertEqual(sorted(self.lazy.items()), sorted(self.expected.items()))
+
+    def test_copy(self):
+        copy = self.lazy.copy()
+        self.assertEqual(copy, self.expected)
+        copy[4] = b'dd'
+        self.assertFalse(4 in self.lazy)
+
+    def test_eq(self):
+        self.assertTrue(self.lazy == self.expected)
+        self.assertTrue(self.expected == self.lazy)
+        self.assertFalse(self.lazy != self.expected)
+        self.assertTrue(self.lazy != {1: b'aa'})
+
+    def test_pop(self):
+        self.assertEqual(self.lazy.pop(2, None), b'bb')
+        self.assertEqual(self.lazy.pop(2, None), None)
+        self.assertRaises(KeyError, self.lazy.pop, 2)
+        self.assertEqual(len(self.lazy), 2)
+
+    def test_popitem(self):
+        items = {}
+        while self.lazy:
+            (key, value) = self.lazy.popitem()
+            items[key] = value
+        self.assertEqual(items, self.expected)
+        self.assertRaises(KeyError, self.lazy.popitem)
+
+    def test_setdefault(self):
+        self.assertEqual(self.lazy.setdefault(2, b'zz'), b'bb')
+        self.assertEqual(self.lazy.setdefault(4, b'dd'), b'dd')
+        self.assertEqual(self.lazy[2], b'bb')
+        self.assertEqual(self.lazy[4], b'dd')
+
+    def test_update(self):
+        self.lazy.update({2: b'zz', 4: b'dd'})
+        self.assertEqual(self.lazy, {1: b'aa', 2: b'zz', 3: b'cc', 4: b'dd'})
+        # The overwritten entry was never decoded.
+        self.assertEqual(sorted(self.decoded), [1, 3])
+
+    def test_delete(self):
+        del(self.lazy[2])
+        self.assertFalse(2 in self.lazy)
+        self.assertRaises(KeyError, self.lazy.__delitem__, 2)
+        self.lazy.clear()
+        self.assertEqual(len(self.lazy), 0)
+        self.assertEqual(self.decoded, [])
+
+
+class TestPacketsRegistry(unittest.TestCase):
+    def test_unknown_opcode(self):
+        opcode = packets.load_opcode(0x0200, memoryview(bytearray(b'\x01\x02')))
+        self.assertEqual(opcode.__class__, packets.Opcode)
+        self.assertEqual(opcode.id, 0x0200)
+        self.assertEqual(opcode.data, bytearray(b'\x01\x02'))
+        self.assertEqual(packets.Opcode().id, None)
+
+    def test_unknown_segment(self):
+        segment = packets.load_segment(0x12345678, memoryview(bytearray(b'\x01\x02')))
+        self.assertEqual(segment.__class__, packets.Extended)
+        self.assertEqual(segment.id, 0x12345678)
+        self.assertEqual(packets.Extended().id, None)
+
+    def test_register_segment(self):
+        class ExtendedTest(packets.ExtendedText):
+            id = 0x12345678
+
+        packets.register_segment(ExtendedTest)
+        try:
+            segment = packets.load_segment(0x12345678, memoryview(bytearray(b'test')))
+            self.assertEqual(segment.__class__, ExtendedTest)
+            self.assertEqual(segment.text, bytearray(b'test'))
+        finally:
+            del(packets.segment_handlers[0x12345678])
+
+    def test_register_opcode_invalid(self):
+        class OpcodeTest(packets.Opcode):
+            id = 0x0003
+
+        self.assertRaises(Exception, packets.register_opcode, OpcodeTest)
+
+
+class TestPacketsPadding(unittest.TestCase):
+    def test_padding(self):
+        self.assertEqual(packets.padding(bytearray(b'abc'), 7, 20).tobytes(), b'abcabca')
+        self.assertEqual(len(packets.padding_buffers[b'abc']), 20)
+        self.assertEqual(packets.padding(bytearray(b'abc'), 25).tobytes(), b'abc' * 8 + b'a')
+        self.assertEqual(len(packets.padding_buffers[b'abc']), 25)
+        self.assertEqual(packets.padding(bytearray(b'\xa5'), 3).tobytes(), b'\xa5\xa5\xa5')
+
+    def test_padding_pattern_change(self):
+        packet = packets.Packet()
+        packet.message_id = 0x00000000a001
+        packet.min_length = 32
+        packet.padding_pattern = bytearray(b'\x01\x02')
+        self.assertEqual(packet.dump()[12:], bytearray(b'\x01\x02' * 10))
+        packet.padding_pattern = bytearray(b'\x03')
+        self.assertEqual(packet.dump()[12:], bytearray(b'\x03' * 20))
+
+
+class TestPacketsHMAC(unittest.TestCase):
+    def test_calculate_hash(self):
+        payload = bytearray(b'Test payload')
+        for digest_index in (1, 2, 3, 4):
+            (hasher, size) = packets.OpcodeHMAC.digest_map[digest_index]
+            reference = bytearray(hmac.new(b'Secret key', payload, hasher).digest())
+            for i in range(2):
+                self.assertEqual(packets.calculate_hash(bytearray(b'Secret key'), digest_index, payload), reference)
+            self.assertTrue((b'Secret key', digest_index) in packets.hmac_contexts)
+
+    def test_verify_hash(self):
+        for digest_index in (1, 2, 3, 4):
+            packet = packets.Packet()
+            packet.message_id = 0x00000000a001
+            packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
+            packet.opcodes[packets.OpcodeHMAC.id] = packets.OpcodeHMAC()
+            packet.opcodes[packets.OpcodeHMAC.id].key = bytearray(b'Secret key')
+            packet.opcodes[packets.OpcodeHMAC.id].digest_index = digest_index
+            packet.min_length = 128
+            data = packet.dump()
+            original = bytearray(data)
+            packet_in = packets.Packet()
+            packet_in.load(data)
+            (pos, length) = packet_in.opcode_data_positions[packets.OpcodeHMAC.id]
+            (valid, calculated) = packets.verify_hash(b'Secret key', digest_index, data, pos + 2, pos + length)
+            self.assertTrue(valid)
+            self.assertEqual(calculated, packet_in.opcodes[packets.OpcodeHMAC.id].hash)
+            self.assertEqual(data, original)
+            (valid, calculated) = packets.verify_hash(b'Wrong key', digest_index, data, pos + 2, pos + length)
+            self.assertFalse(valid)
+
+    def test_hmac_sha256_vector(self):
+        # Digest index 3 is HMAC-SHA256 with a 32-octet hash (2ping-protocol.md).
+        packet = packets.Packet()
+        packet.message_id = 0x00000000a001
+        packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
+        packet.opcodes[packets.OpcodeHMAC.id] = packets.OpcodeHMAC()
+        packet.opcodes[packets.OpcodeHMAC.id].key = bytearray(b'Secret key')
+        packet.opcodes[packets.OpcodeHMAC.id].digest_index = 3
+        reference = bytearray(
+            b'\x32\x50\x80\x0b\x00\x00\x00\x00\xa0\x01\x00\x81\x00\x00\x00\x22\x00\x03'
+            b'\xf3\x51\x11\x65\x10\xa8\x21\xe9\x67\xf5\x50\x93\x3d\x58\x5a\x9b'
+            b'\xd5\xb3\x75\x79\xa9\x68\x89\x24\x1a\x76\x1a\x9a\xe5\xa2\x8c\xca'
+        )
+        self.assertEqual(packet.dump(), reference)
+        packet_in = packets.Packet()
+        packet_in.load(reference)
+        self.assertEqual(packet_in.opcodes[packets.OpcodeHMAC.id].digest_index, 3)
+        self.assertEqual(packet_in.opcodes[packets.OpcodeHMAC.id].hash, reference[18:])
+
+    def test_compare_digest(self):
+        self.assertTrue(packets.compare_digest(bytearray(b'abc'), memoryview(b'abc')))
+        self.assertFalse(packets.compare_digest(bytearray(b'abc'), memoryview(b'abd')))
+        self.assertFalse(packets.compare_digest(bytearray(b'abc'), memoryview(b'ab')))
+
+
+class TestPacketTemplate(unittest.TestCase):
+    def setUp(self):
+        packet = packets.Packet()
+        packet.opcodes[packets.OpcodeExtended.id] = packets.OpcodeExtended()
+        packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedVersion.id] = packets.ExtendedVersion()
+        packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedVersion.id].text = bytearray(b'Test 2ping version')
+        packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedWallClock.id] = packets.ExtendedWallClock()
+        packet.opcodes[packets.OpcodeHMAC.id] = packets.OpcodeHMAC()
+        packet.opcodes[packets.OpcodeHMAC.id].key = bytearray(b'Secret key')
+        packet.opcodes[packets.OpcodeHMAC.id].digest_index = 1
+        packet.min_length = 128
+        packet.max_length = 512
+        packet.padding_pattern = bytearray(b'\xa5\x5a')
+        self.template = packets.PacketTemplate(packet, dynamic_segments=(packets.ExtendedWallClock.id,))
+
+    def reference_dump(self, packet):
+        reference = packets.Packet()
+        reference.message_id = packet.message_id
+        reference.opcodes = packet.opcodes
+        reference.min_length = packet.min_length
+        reference.max_length = packet.max_length
+        reference.padding_pattern = packet.padding_pattern
+        return reference.serialize()
+
+    def test_template_matches_serialize(self):
+        for i in range(4):
+            self.template.packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedWallClock.id].time_us = 1454187789993266 + i
+            packet = self.template.new_packet()
+            packet.message_id = 0x00000000a000 + i
+            packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
+            packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b000 + i
+            packet.opcodes[packets.OpcodeHostLatency.id] = packets.OpcodeHostLatency()
+            packet.opcodes[packets.OpcodeHostLatency.id].delay_us = 1000 * i
+            self.assertEqual(packet.dump(), self.reference_dump(packet))
+        self.assertEqual(len(self.template.layouts), 1)
+
+    def test_dump_many(self):
+        message_ids = [0x00000000c000 + i for i in range(4)]
+        for packet in (self.template.new_packet(), self.template.packet):
+            packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
+            outs = packet.dump_many(message_ids)
+            self.assertEqual(len(outs), 4)
+            for (message_id, out) in zip(message_ids, outs):
+                packet.message_id = message_id
+                self.assertEqual(out, self.reference_dump(packet))
+        self.assertEqual(self.template.packet.dump_many([]), [])
+
+    def test_template_shapes(self):
+        for i in range(3):
+            packet = self.template.new_packet()
+            packet.message_id = 0x00000000a001
+            packet.opcodes[packets.OpcodeInvestigate.id] = packets.OpcodeInvestigate()
+            for j in range(i + 1):
+                packet.opcodes[packets.OpcodeInvestigate.id].message_ids.append(0x00000000b000 + j)
+            self.assertEqual(packet.dump(), self.reference_dump(packet))
+            self.assertEqual(packet.dump(), self.reference_dump(packet))
+        self.assertEqual(len(self.template.layouts), 3)
+
+    def test_template_truncation(self):
+        packet = self.template.new_packet()
+        packet.message_id = 0x00000000a001
+        packet.opcodes[packets.OpcodeCourtesyExpiration.id] = packets.OpcodeCourtesyExpiration()
+        for j in range(100):
+            packet.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids.append(0x00000000b000 + j)
+        out = packet.dump()
+        self.assertEqual(out, self.reference_dump(packet))
+        self.assertTrue(len(out) <= 512)
+
+    def test_template_manifest(self):
+        for i in range(2):
+            packet = self.template.new_packet()
+            packet.opcodes[packets.OpcodeInReplyTo.id] = packets.OpcodeInReplyTo()
+            packet.opcodes[packets.OpcodeInReplyTo.id].message_id = 0x00000000b001
+            (out, manifest) = packet.dump(manifest=True)
+            packet_in = packets.Packet()
+            packet_in.load(out)
+            self.assertEqual(manifest.opcode_data_positions, packet_in.opcode_data_positions)
+
+
+class TestPacketManifest(unittest.TestCase):
+    def test_manifest_truncated(self):
+        packet = packets.Packet()
+        packet.max_length = 128
+        packet.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
+        packet.opcodes[packets.OpcodeCourtesyExpiration.id] = packets.OpcodeCourtesyExpiration()
+        for j in range(50):
+            packet.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids.append(0x00000000b000 + j)
+        (out, manifest) = packet.dump(manifest=True)
+        packet_in = packets.Packet()
+        packet_in.load(out)
+        self.assertEqual(manifest.opcode_flags, 0x0041)
+        self.assertEqual(manifest.opcode_data_positions, packet_in.opcode_data_positions)
+        self.assertEqual(
+            manifest.message_ids[packets.OpcodeCourtesyExpiration.id],
+            packet_in.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids,
+        )
+        self.assertEqual(len(manifest.message_ids[packets.OpcodeCourtesyExpiration.id]), 18)
+
+
 if __name__ == '__main__':
     unittest.main()
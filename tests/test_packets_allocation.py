@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Allocation benchmark for packet load/dump cycles.  Run directly to
+# print a report:
+#
+#     python -m tests.test_packets_allocation
+
+from __future__ import print_function, division
+import gc
+import sys
+import types
+import unittest
+from twoping import packets
+from tests.packet_fixtures import reference_packet, load_lazy, load_all
+
+
+def dump_cycle():
+    packet = reference_packet()
+    packet.dump()
+    return packet
+
+
+def graph_size(obj):
+    '''Total sys.getsizeof() of everything reachable from obj
+
+    Classes, functions and memoryviews (the packet being parsed) are
+    not counted.
+    '''
+    seen = set()
+    total = 0
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, (type, types.ClassType, types.FunctionType, types.ModuleType, memoryview)):
+            continue
+        total += sys.getsizeof(o)
+        todo.extend(gc.get_referents(o))
+    return total
+
+
+def tracked_objects(func, cycles=100):
+    '''Average number of GC-tracked objects kept alive per call of func'''
+    results = []
+    gc.collect()
+    before = len(gc.get_objects())
+    for i in xrange(cycles):
+        results.append(func())
+    after = len(gc.get_objects())
+    # Don't count the results list itself.
+    return (after - before - 1) / cycles
+
+
+class TestPacketsAllocation(unittest.TestCase):
+    def setUp(self):
+        self.data = reference_packet().dump()
+
+    def test_no_instance_dicts(self):
+        packet = load_all(self.data)
+        self.assertFalse(hasattr(packet, '__dict__'))
+        for opcode in packet.opcodes.values():
+            self.assertFalse(hasattr(opcode, '__dict__'))
+        for segment in packet.opcodes[packets.OpcodeExtended.id].segments.values():
+            self.assertFalse(hasattr(segment, '__dict__'))
+
+    # On 64-bit Python 2.7, a fully decoded reference packet measures
+    # about 5960 bytes in 20 tracked objects; without __slots__ it is
+    # about 10230 bytes in 26 objects.  The bounds sit between the two.
+
+    def test_graph_size(self):
+        size = graph_size(load_all(self.data))
+        self.assertTrue(size < 8000, size)
+
+    def test_tracked_objects(self):
+        count = tracked_objects(lambda: load_all(self.data))
+        self.assertTrue(count < 23, count)
+
+
+def main():
+    packet = reference_packet()
+    data = packet.dump()
+    print('Packet: %d bytes, %d opcodes' % (len(data), len(packet.opcodes)))
+    print('load:      %6.1f objects, %6d bytes per packet' % (
+        tracked_objects(lambda: load_all(data)),
+        graph_size(load_all(data)),
+    ))
+    print('lazy load: %6.1f objects, %6d bytes per packet' % (
+        tracked_objects(lambda: load_lazy(data)),
+        graph_size(load_lazy(data)),
+    ))
+    print('dump:      %6.1f objects, %6d bytes per packet' % (
+        tracked_objects(dump_cycle),
+        graph_size(dump_cycle()),
+    ))
+
+
+if __name__ == '__main__':
+    main()
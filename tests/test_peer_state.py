@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import unittest
+import socket
+from twoping import cli
+from twoping.args import parse_args
+
+
+class TestPeerState(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_class = cli.SocketClass(self.sock)
+
+    def tearDown(self):
+        self.sock.close()
+
+    def test_peer_state(self):
+        peer = self.sock_class.peer_state(('192.0.2.1', 15998), 1.0)
+        self.assertIs(self.sock_class.peer_state(('192.0.2.1', 15998), 2.0), peer)
+        self.assertIsNot(self.sock_class.peer_state(('192.0.2.1', 15999), 2.0), peer)
+        self.assertEqual(peer.last_activity, 2.0)
+        self.assertEqual(peer.ping_position, 0)
+
+    def test_slots(self):
+        peer = cli.PeerState(('192.0.2.1', 15998), 1.0)
+        with self.assertRaises(AttributeError):
+            peer.unknown = True
+
+    def test_is_idle(self):
+        peer = cli.PeerState(('192.0.2.1', 15998), 1.0)
+        self.assertFalse(peer.is_idle(2.0))
+        self.assertTrue(peer.is_idle(1000.0))
+        peer.seen_messages[1] = 1.0
+        self.assertFalse(peer.is_idle(1000.0))
+
+    def test_cleanup(self):
+        t = cli.TwoPing(parse_args(['2ping', '--listen']))
+        now = cli.clock()
+        old = self.sock_class.peer_state(('192.0.2.1', 15998), now - 1000.0)
+        old.sent_messages[1] = (now - 1000.0, 1)
+        old.courtesy_messages[2] = now - 1000.0
+        current = self.sock_class.peer_state(('192.0.2.2', 15998), now)
+        current.seen_messages[3] = now
+        t.scheduled_cleanup_sock_class(self.sock_class)
+        self.assertEqual(list(self.sock_class.peers.values()), [current])
+        self.assertEqual(current.seen_messages, {3: now})
+
+    def test_cleanup_client(self):
+        # A client keeps its peer, and so its ping sequence, when idle.
+        t = cli.TwoPing(parse_args(['2ping', '192.0.2.1']))
+        now = cli.clock()
+        peer = self.sock_class.peer_state(('192.0.2.1', 15998), now - 1000.0)
+        peer.ping_position = 5
+        t.scheduled_cleanup_sock_class(self.sock_class)
+        self.assertIs(self.sock_class.peer_state(('192.0.2.1', 15998), now), peer)
+        self.assertEqual(peer.ping_position, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+import unittest
+from twoping import random_pool
+from twoping import packets
+
+
+class TestRandomPool(unittest.TestCase):
+    def test_read(self):
+        pool = random_pool.RandomPool(size=16)
+        self.assertEqual(len(pool.read(10)), 10)
+        self.assertEqual(len(pool.read(10)), 10)
+        self.assertEqual(len(pool.read(40)), 40)
+        self.assertEqual(len(pool.read(0)), 0)
+
+    def test_read_uint48(self):
+        pool = random_pool.RandomPool(size=16)
+        for i in range(10):
+            message_id = pool.read_uint48()
+            self.assertTrue(0 <= message_id < 2**48)
+
+    def test_reset(self):
+        pool = random_pool.RandomPool(size=16)
+        pool.read(10)
+        pool.reset()
+        self.assertEqual(len(pool.read(10)), 10)
+
+    def test_new_message_id_exclude(self):
+        exclude = {}
+        for i in range(100):
+            message_id = packets.new_message_id(exclude)
+            self.assertNotIn(message_id, exclude)
+            exclude[message_id] = i
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import unittest
+from twoping import scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def test_pop_due(self):
+        timers = scheduler.Scheduler()
+        timers.schedule('c', 3.0)
+        timers.schedule('a', 1.0)
+        timers.schedule('b', 2.0)
+        self.assertEqual(timers.peek(), (1.0, 'a'))
+        self.assertEqual(timers.pop_due(0.5), [])
+        self.assertEqual(timers.pop_due(2.0), ['a', 'b'])
+        self.assertEqual(len(timers), 1)
+        self.assertNotIn('a', timers)
+        self.assertEqual(timers.pop_due(10.0), ['c'])
+        self.assertEqual(timers.peek(), None)
+
+    def test_reschedule(self):
+        timers = scheduler.Scheduler()
+        timers.schedule('a', 1.0)
+        timers.schedule('b', 2.0)
+        timers.schedule('a', 3.0)
+        self.assertEqual(len(timers), 2)
+        self.assertEqual(timers.peek(), (2.0, 'b'))
+        self.assertEqual(timers.pop_due(2.5), ['b'])
+        timers.schedule('a', 0.5)
+        self.assertEqual(timers.pop_due(10.0), ['a'])
+
+    def test_cancel(self):
+        timers = scheduler.Scheduler()
+        timers.schedule('a', 1.0)
+        timers.schedule('b', 2.0)
+        timers.cancel('a')
+        timers.cancel('z')
+        self.assertEqual(timers.peek(), (2.0, 'b'))
+        self.assertEqual(timers.pop_due(10.0), ['b'])
+
+    def test_ties(self):
+        # Keys with the same time come out in the order they were scheduled,
+        # and are never compared with each other.
+        timers = scheduler.Scheduler()
+        keys = [object() for i in range(10)]
+        for key in keys:
+            timers.schedule(key, 1.0)
+        self.assertEqual(timers.pop_due(1.0), keys)
+
+    def test_compact(self):
+        timers = scheduler.Scheduler()
+        for i in range(1000):
+            timers.schedule('a', float(i))
+        self.assertTrue(len(timers.heap) < 100)
+        self.assertEqual(timers.pop_due(1000.0), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from twoping import cli
+from twoping import workers
+from twoping.args import parse_args
+
+
+class TestWorkers(unittest.TestCase):
+    def test_merge_stats(self):
+        t = cli.TwoPing(parse_args(['2ping', '--listen', '--workers', '2']))
+        a = workers.collect_stats(t)
+        b = workers.collect_stats(t)
+        a.update({'pings_received': 3, 'rtt_count': 1, 'rtt_min': 2.0, 'rtt_max': 2.0, 'rtt_ewma': 2.0})
+        a['parse_failures'] = {'ValueError': 1}
+        b.update({'pings_received': 5, 'rtt_count': 3, 'rtt_min': 1.0, 'rtt_max': 4.0, 'rtt_ewma': 4.0})
+        b['parse_failures'] = {'ValueError': 2, 'IndexError': 1}
+        # An idle worker has no RTT samples, and must not count as a 0 minimum.
+        c = workers.collect_stats(t)
+
+        workers.merge_stats(t, [a, b, c])
+        self.assertEqual(t.pings_received, 8)
+        self.assertEqual(t.rtt_count, 4)
+        self.assertEqual(t.rtt_min, 1.0)
+        self.assertEqual(t.rtt_max, 4.0)
+        self.assertEqual(t.rtt_ewma, 3.5)
+        self.assertEqual(t.parse_failures, {'ValueError': 3, 'IndexError': 1})
+
+    def test_merge_stats_empty(self):
+        t = cli.TwoPing(parse_args(['2ping', '--listen', '--workers', '2']))
+        workers.merge_stats(t, [])
+        self.assertEqual(t.pings_received, 0)
+        self.assertEqual(t.rtt_min, 0)
+        self.assertEqual(t.rtt_ewma, 0)
+
+    def test_count_rejected(self):
+        self.assertRaises(SystemExit, parse_args, ['2ping', '--listen', '--workers', '2', '-c', '1'])
+
+    def test_reseed_fuzzer(self):
+        t = cli.TwoPing(parse_args(['2ping', '--listen', '--workers', '2', '--fuzz', '10', '--fuzz-seed', '100']))
+        supervisor = workers.Supervisor(t)
+        streams = []
+        for index in range(2):
+            supervisor.reseed_worker(index)
+            self.assertEqual(t.fuzzer.seed, 100 + index)
+            streams.append([t.fuzzer.random.random() for i in range(4)])
+        self.assertNotEqual(streams[0], streams[1])
+
+    def test_stop_while_processing(self):
+        # StopWorker must not be mistaken for a bad packet.
+        t = cli.TwoPing(parse_args(['2ping', '--listen', '-q']))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        sock_class = cli.SocketClass(sock)
+
+        def process_incoming_packet(sock_class, data, peer_address):
+            raise workers.StopWorker()
+        t.process_incoming_packet = process_incoming_packet
+        datagrams = [(bytearray(128), 128, ('127.0.0.1', 15998))]
+        self.assertRaises(workers.StopWorker, t.process_incoming_datagrams, sock_class, datagrams)
+        self.assertEqual(t.parse_failures, {})
+
+
+@unittest.skipUnless(workers.has_workers, 'fork() and SO_REUSEPORT not available')
+class TestSupervisor(unittest.TestCase):
+    def free_port(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def twoping(self, *args):
+        return subprocess.Popen(
+            [sys.executable, '-m', 'twoping.cli'] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+
+    def test_sigterm_under_load(self):
+        # SIGTERM while the workers are busy: they must stop promptly and
+        # report, rather than wait to be killed.
+        port = str(self.free_port())
+        listener = self.twoping('--listen', '--workers', '2', '-I', '127.0.0.1', '--port', port, '-q')
+        time.sleep(1)
+        clients = [self.twoping('127.0.0.1', '--port', port, '-f', '-q', '-w', '3') for i in range(4)]
+        time.sleep(1)
+        start = time.time()
+        listener.send_signal(signal.SIGTERM)
+        output = listener.communicate()[0].decode('utf-8')
+        elapsed = time.time() - start
+        for client in clients:
+            client.send_signal(signal.SIGINT)
+            client.communicate()
+
+        self.assertEqual(listener.returncode, 0)
+        # The supervisor gives workers 5 seconds before SIGKILL.
+        self.assertTrue(elapsed < 4, elapsed)
+        self.assertNotIn('Exception', output)
+        self.assertNotIn('Traceback', output)
+        # The workers' final reports made it into the statistics.
+        received = int(output.split(' raw packets transmitted, ')[1].split(' ')[0])
+        self.assertTrue(received > 0, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -110,14 +110,27 @@ def parse_args(argv=None):
         choices=['hmac-md5', 'hmac-sha1', 'hmac-sha256', 'hmac-crc32'],
         help=_('HMAC authentication digest'), metavar='DIGEST',
     )
+    parser.add_argument(
+        '--batch-size', type=int, default=1,
+        help=_('datagrams per receive/send call (Linux)'), metavar='COUNT',
+    )
     parser.add_argument(
         '--debug', action='store_true',
         help=_('debug mode'),
     )
+    parser.add_argument(
+        '--engine', type=str, default='builtin',
+        choices=['builtin', 'asyncio'],
+        help=_('event loop to run on'), metavar='ENGINE',
+    )
     parser.add_argument(
         '--fuzz', type=float,
         help=_('incoming fuzz percentage'), metavar='PERCENT',
     )
+    parser.add_argument(
+        '--fuzz-seed', type=int,
+        help=_('random seed for --fuzz'), metavar='SEED',
+    )
     parser.add_argument(
         '--inquire-wait', type=float, default=10.0,
         help=_('maximum time before loss inquiries'), metavar='SECONDS',
@@ -170,6 +183,10 @@ def parse_args(argv=None):
         '--port', type=str, default='15998',
         help=_('port to connect / bind to'),
     )
+    parser.add_argument(
+        '--receive-budget', type=int, default=64,
+        help=_('maximum datagrams to receive per socket per wakeup'), metavar='COUNT',
+    )
     parser.add_argument(
         '--send-monotonic-clock', action='store_true',
         help=_('send monotonic clock to peers'),
@@ -190,6 +207,10 @@ def parse_args(argv=None):
         '--srv', action='store_true',
         help=_('lookup SRV records in client mode'),
     )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help=_('number of listener processes'), metavar='COUNT',
+    )
 
     # ping-compatible ignored options
     for opt in 'b|B|d|L|n|R|r|U'.split('|'):
@@ -240,6 +261,16 @@ def parse_args(argv=None):
         parser.error(_('Maximum packet size must be at least minimum packet size'))
     if args.max_packet_size < 64:
         parser.error(_('Maximum packet size must be at least 64'))
+    if args.batch_size < 1:
+        parser.error(_('Batch size must be at least 1'))
+    if args.receive_budget < 1:
+        parser.error(_('Receive budget must be at least 1'))
+    if args.workers < 1:
+        parser.error(_('Workers must be at least 1'))
+    if (args.workers > 1) and (not args.listen):
+        parser.error(_('Multiple workers are only supported with --listen'))
+    if (args.workers > 1) and args.count:
+        parser.error(_('Multiple workers cannot be used with --count'))
     args.packet_loss_in = 0
     args.packet_loss_out = 0
     if args.packet_loss:
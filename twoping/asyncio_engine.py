@@ -0,0 +1,166 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# asyncio engine (--engine=asyncio), an alternative to TwoPing.loop().
+#
+# Each socket gets a reader callback which runs the same receive path as
+# the builtin loop, and each client socket gets its own send timer, so
+# nothing scans every socket to work out the next wakeup.  Cleanup, stats
+# and the deadline are timers too.  On Python 2, trollius stands in for
+# asyncio.
+#
+# To run 2ping inside an existing event loop, set up the TwoPing instance
+# and pass the loop to AsyncioEngine; start() registers everything, and
+# the finished future is resolved with the exit status.
+
+from __future__ import print_function, division
+from . import monotonic_clock
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+clock = monotonic_clock.clock
+
+
+def new_event_loop():
+    return asyncio.new_event_loop()
+
+
+class AsyncioEngine():
+    def __init__(self, twoping, loop=None):
+        self.twoping = twoping
+        self.args = twoping.args
+        self.owns_loop = loop is None
+        if loop is None:
+            loop = new_event_loop()
+        self.loop = loop
+        self.loop_type = '%s.%s' % (loop.__class__.__module__, loop.__class__.__name__)
+        self.finished = asyncio.Future(loop=loop)
+
+        # Pending send timers, by socket: (send time, timer handle).
+        self.send_handles = {}
+        self.cleanup_handle = None
+        self.stats_handle = None
+        self.deadline_handle = None
+
+    def call_at_clock(self, when, callback, *args):
+        '''Schedule callback for when, a value of clock()'''
+        return self.loop.call_later(max(when - clock(), 0), callback, *args)
+
+    def start(self):
+        t = self.twoping
+        for sock_class in t.sock_classes:
+            self.loop.add_reader(sock_class.fileno(), self.readable, sock_class)
+            if not self.args.listen:
+                self.schedule_send(sock_class)
+        self.cleanup_handle = self.call_at_clock(t.next_cleanup, self.cleanup)
+        if self.args.stats:
+            self.stats_handle = self.call_at_clock(t.next_stats, self.stats)
+        if self.args.deadline:
+            self.deadline_handle = self.call_at_clock(t.time_start + self.args.deadline, self.shutdown)
+
+    def run(self):
+        '''Run until shutdown on our own loop, returning the exit status'''
+        self.start()
+        try:
+            return self.loop.run_until_complete(self.finished)
+        finally:
+            if self.owns_loop:
+                self.loop.close()
+
+    def stop(self):
+        for sock_class in self.twoping.sock_classes:
+            self.loop.remove_reader(sock_class.fileno())
+        for (when, handle) in self.send_handles.values():
+            handle.cancel()
+        self.send_handles = {}
+        for handle in (self.cleanup_handle, self.stats_handle, self.deadline_handle):
+            if handle is not None:
+                handle.cancel()
+
+    def shutdown(self):
+        t = self.twoping
+        t.print_stats()
+        if self.args.nagios:
+            self.finish(t.nagios_result)
+        else:
+            self.finish(0)
+
+    def finish(self, result=None, exception=None):
+        self.stop()
+        if self.finished.done():
+            return
+        if exception is not None:
+            self.finished.set_exception(exception)
+        else:
+            self.finished.set_result(result)
+
+    def check_shutdown(self):
+        if self.twoping.all_shutdown():
+            self.shutdown()
+
+    def schedule_send(self, sock_class):
+        '''(Re)schedule the send timer for sock_class.next_send'''
+        if sock_class.is_shutdown:
+            return
+        if sock_class in self.send_handles:
+            (when, handle) = self.send_handles[sock_class]
+            if when <= sock_class.next_send:
+                return
+            handle.cancel()
+        self.send_handles[sock_class] = (
+            sock_class.next_send,
+            self.call_at_clock(sock_class.next_send, self.send, sock_class),
+        )
+
+    def send(self, sock_class):
+        del(self.send_handles[sock_class])
+        now = clock()
+        self.twoping.scheduled_send(sock_class, now)
+        if self.args.flood and (now + 0.01 < sock_class.next_send):
+            sock_class.next_send = now + 0.01
+        self.schedule_send(sock_class)
+        self.check_shutdown()
+
+    def readable(self, sock_class):
+        try:
+            self.twoping.process_incoming_packets(sock_class)
+        except Exception as e:
+            # Only raised with --debug, where the builtin loop would exit.
+            self.finish(exception=e)
+            return
+        self.twoping.incoming_packets_done(sock_class, clock())
+        if not self.args.listen:
+            # A reply may have brought the next send forward (--flood,
+            # --adaptive).
+            self.schedule_send(sock_class)
+        self.check_shutdown()
+
+    def cleanup(self):
+        t = self.twoping
+        t.scheduled_cleanup()
+        t.next_cleanup = clock() + 60.0
+        self.cleanup_handle = self.call_at_clock(t.next_cleanup, self.cleanup)
+
+    def stats(self):
+        t = self.twoping
+        t.print_stats(short=True)
+        t.next_stats = clock() + self.args.stats
+        self.stats_handle = self.call_at_clock(t.next_stats, self.stats)
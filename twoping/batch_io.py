@@ -0,0 +1,302 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# Batched datagram I/O.
+#
+# recv() returns a list of (buffer, length, address) tuples, and send()
+# sends a list of (data, address) tuples.  Datagrams are received into
+# pooled bytearrays, which the caller hands back with release() once it
+# is done with them, so receiving allocates nothing.  On Linux,
+# MmsgBatchIO does each with a single recvmmsg() / sendmmsg() call
+# through ctypes; elsewhere SimpleBatchIO falls back to one recvfrom() /
+# sendto() per datagram.
+# Addresses are the same tuples recvfrom() returns and sendto() takes.
+# recv() never blocks, and returns an empty list once the socket has
+# nothing left to read.  Sends which find the send buffer full (EAGAIN)
+# are retried with the socket briefly set blocking, so a full buffer
+# delays a ping rather than dropping it as an error.
+
+from __future__ import print_function
+import sys
+import os
+import errno
+import socket
+import struct
+
+# recvfrom() size used by 2ping.
+max_datagram_size = 16384
+
+MSG_DONTWAIT = 0x40
+
+sockaddr_in_struct = struct.Struct('=H2s4s8x')
+sockaddr_in6_struct = struct.Struct('=H2s4s16sI')
+port_struct = struct.Struct('!H')
+flowinfo_struct = struct.Struct('!I')
+
+
+def sendto(sock, data, address):
+    '''sock.sendto(), waiting for room if the send buffer is full'''
+    try:
+        return sock.sendto(data, address)
+    except socket.error as e:
+        if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    sock.setblocking(True)
+    try:
+        return sock.sendto(data, address)
+    finally:
+        sock.setblocking(False)
+
+
+class BufferPool():
+    '''Preallocated receive buffers
+
+    get() only allocates a new buffer when all of them are in use.
+    '''
+
+    def __init__(self, size, count=0):
+        self.size = size
+        self.free = [bytearray(size) for i in range(count)]
+
+    def get(self):
+        try:
+            return self.free.pop()
+        except IndexError:
+            return bytearray(self.size)
+
+    def put(self, buf):
+        self.free.append(buf)
+
+
+class SimpleBatchIO():
+    io_type = 'simple'
+
+    def __init__(self, batch_size=1):
+        self.batch_size = 1
+        self.pool = BufferPool(max_datagram_size, 1)
+
+    def recv(self, sock):
+        buf = self.pool.get()
+        try:
+            (length, address) = sock.recvfrom_into(buf)
+        except socket.error as e:
+            self.pool.put(buf)
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+        return [(buf, length, address)]
+
+    def release(self, buf):
+        self.pool.put(buf)
+
+    def send(self, sock, datagrams):
+        '''Send each (data, address) in datagrams
+
+        Returns a list of (address, socket.error) for datagrams which
+        could not be sent.
+        '''
+        errors = []
+        for (data, address) in datagrams:
+            try:
+                sendto(sock, data, address)
+            except socket.error as e:
+                errors.append((address, e))
+        return errors
+
+
+class MmsgBatchIO():
+    io_type = 'recvmmsg'
+
+    def __init__(self, batch_size):
+        if not sys.platform.startswith('linux'):
+            raise AttributeError('recvmmsg is only available on Linux')
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # Raises AttributeError if libc is too old.
+        self.recvmmsg = libc.recvmmsg
+        self.sendmmsg = libc.sendmmsg
+        self.if_indextoname = getattr(libc, 'if_indextoname', None)
+
+        class iovec(ctypes.Structure):
+            _fields_ = [
+                ('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t),
+            ]
+
+        class msghdr(ctypes.Structure):
+            _fields_ = [
+                ('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int),
+            ]
+
+        class mmsghdr(ctypes.Structure):
+            _fields_ = [
+                ('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint),
+            ]
+
+        self.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        self.recvmmsg.restype = ctypes.c_int
+        self.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        self.sendmmsg.restype = ctypes.c_int
+
+        # Address buffers and headers are allocated once and reused for
+        # every call.  Each slot holds a pooled buffer; a slot which
+        # received a datagram gets a fresh buffer from the pool.
+        self.batch_size = batch_size
+        self.name_size = 128
+        self.pool = BufferPool(max_datagram_size, batch_size * 2)
+        # ctypes views of the pooled buffers, by id().  A view keeps its
+        # buffer alive, so the id() is never reused.
+        self.views = {}
+        self.slots = [None] * batch_size
+        self.names = [ctypes.create_string_buffer(self.name_size) for i in range(batch_size)]
+        self.recv_iovecs = (iovec * batch_size)()
+        self.recv_msgs = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self.set_slot(i, self.pool.get())
+            self.recv_iovecs[i].iov_len = max_datagram_size
+            self.recv_msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.recv_iovecs[i])
+            self.recv_msgs[i].msg_hdr.msg_iovlen = 1
+            self.recv_msgs[i].msg_hdr.msg_name = ctypes.addressof(self.names[i])
+        self.iovec = iovec
+        self.mmsghdr = mmsghdr
+
+    def set_slot(self, i, buf):
+        try:
+            view = self.views[id(buf)]
+        except KeyError:
+            view = self.views[id(buf)] = (self.ctypes.c_char * len(buf)).from_buffer(buf)
+        self.slots[i] = buf
+        self.recv_iovecs[i].iov_base = self.ctypes.addressof(view)
+
+    def release(self, buf):
+        self.pool.put(buf)
+
+    def raise_errno(self):
+        e = self.ctypes.get_errno()
+        raise socket.error(e, os.strerror(e))
+
+    def decode_address(self, name):
+        family = struct.unpack_from('=H', name)[0]
+        if family == socket.AF_INET:
+            (family, port, addr) = sockaddr_in_struct.unpack_from(name)
+            return (socket.inet_ntop(socket.AF_INET, addr), port_struct.unpack(port)[0])
+        elif family == socket.AF_INET6:
+            (family, port, flowinfo, addr, scope_id) = sockaddr_in6_struct.unpack_from(name)
+            host = socket.inet_ntop(socket.AF_INET6, addr)
+            if scope_id and self.if_indextoname is not None:
+                # recvfrom() names the scope of link-local addresses.
+                ifname = self.ctypes.create_string_buffer(16)
+                if self.if_indextoname(scope_id, ifname):
+                    host = '%s%%%s' % (host, ifname.value)
+            return (host, port_struct.unpack(port)[0], flowinfo_struct.unpack(flowinfo)[0], scope_id)
+        raise socket.error(errno.EAFNOSUPPORT, os.strerror(errno.EAFNOSUPPORT))
+
+    def encode_address(self, family, address):
+        host = address[0].split('%', 1)[0]
+        port = port_struct.pack(address[1])
+        if family == socket.AF_INET:
+            return sockaddr_in_struct.pack(family, port, socket.inet_pton(family, host))
+        elif family == socket.AF_INET6:
+            flowinfo = address[2] if len(address) > 2 else 0
+            scope_id = address[3] if len(address) > 3 else 0
+            return sockaddr_in6_struct.pack(
+                family, port, flowinfo_struct.pack(flowinfo), socket.inet_pton(family, host), scope_id,
+            )
+        raise socket.error(errno.EAFNOSUPPORT, os.strerror(errno.EAFNOSUPPORT))
+
+    def recv(self, sock):
+        for i in range(self.batch_size):
+            self.recv_msgs[i].msg_hdr.msg_namelen = self.name_size
+        res = self.recvmmsg(sock.fileno(), self.recv_msgs, self.batch_size, MSG_DONTWAIT, None)
+        if res < 0:
+            if self.ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            self.raise_errno()
+        out = []
+        for i in range(res):
+            out.append((self.slots[i], self.recv_msgs[i].msg_len, self.decode_address(self.names[i].raw)))
+            self.set_slot(i, self.pool.get())
+        return out
+
+    def send(self, sock, datagrams):
+        '''Send each (data, address) in datagrams
+
+        Returns a list of (address, socket.error) for datagrams which
+        could not be sent.
+        '''
+        ctypes = self.ctypes
+        errors = []
+        pos = 0
+        while pos < len(datagrams):
+            batch = datagrams[pos:(pos + self.batch_size)]
+            count = len(batch)
+            iovecs = (self.iovec * count)()
+            msgs = (self.mmsghdr * count)()
+            # Keep the buffers alive until sendmmsg() returns.
+            refs = []
+            for (i, (data, address)) in enumerate(batch):
+                data = bytes(data)
+                name = self.encode_address(sock.family, address)
+                refs.append((data, name))
+                iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+                iovecs[i].iov_len = len(data)
+                msgs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+                msgs[i].msg_hdr.msg_iovlen = 1
+                msgs[i].msg_hdr.msg_name = ctypes.cast(ctypes.c_char_p(name), ctypes.c_void_p)
+                msgs[i].msg_hdr.msg_namelen = len(name)
+            res = self.sendmmsg(sock.fileno(), msgs, count, 0)
+            if (res < 0) and (ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                # The send buffer is full; wait for room, as sendto() does.
+                sock.setblocking(True)
+                try:
+                    res = self.sendmmsg(sock.fileno(), msgs, count, 0)
+                finally:
+                    sock.setblocking(False)
+            if res < 0:
+                # The first datagram failed; report it and carry on after it.
+                e = ctypes.get_errno()
+                errors.append((batch[0][1], socket.error(e, os.strerror(e))))
+                res = 1
+            elif res == 0:
+                # Nothing sent and no error; skip it rather than retry forever.
+                errors.append((batch[0][1], socket.error(errno.EIO, os.strerror(errno.EIO))))
+                res = 1
+            pos += res
+        return errors
+
+
+def best_batch_io(batch_size=1):
+    if batch_size > 1:
+        try:
+            return MmsgBatchIO(batch_size)
+        except (AttributeError, OSError):
+            pass
+    return SimpleBatchIO(batch_size)
+
+
+if __name__ == '__main__':
+    print('Best batch I/O: %s' % best_batch_io(32).io_type)
@@ -0,0 +1,87 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# 2ping checksum: the RFC 768 / RFC 1071 16-bit ones' complement sum.
+#
+# Words are summed in bulk with a struct layout per word count, and the
+# (unfolded) sum is only folded once at the end.  word_sum() and finish()
+# are exposed separately so callers can combine the sums of several
+# regions, and update() implements RFC 1624 incremental updates for
+# packets which are patched in place.
+
+from __future__ import print_function, division
+import struct
+
+byte_struct = struct.Struct('!B')
+word_structs = {}
+
+
+def word_sum(data, offset=0):
+    '''Unfolded sum of the big-endian 16-bit words in data
+
+    offset is the position of data within the checksummed buffer; only
+    its parity matters.  A region starting at an odd offset contributes
+    its first byte as the low half of a word.
+    '''
+    data_length = len(data)
+    total = 0
+    pos = 0
+    if (offset & 1) and data_length:
+        total += byte_struct.unpack_from(data)[0]
+        pos = 1
+    words = (data_length - pos) >> 1
+    if words:
+        try:
+            s = word_structs[words]
+        except KeyError:
+            s = word_structs[words] = struct.Struct('!%dH' % words)
+        total += sum(s.unpack_from(data, pos))
+    if (data_length - pos) & 1:
+        total += byte_struct.unpack_from(data, data_length - 1)[0] << 8
+    return total
+
+
+def finish(total):
+    '''Fold and complement an unfolded word sum into a 2ping checksum'''
+    while total >> 16:
+        total = (total >> 16) + (total & 0xffff)
+    checksum = ~total & 0xffff
+
+    if checksum == 0:
+        checksum = 0xffff
+
+    return checksum
+
+
+def twoping_checksum(d):
+    return finish(word_sum(d))
+
+
+def update(checksum, offset, old_data, new_data):
+    '''Incrementally update a checksum after a region has been replaced
+
+    old_data and new_data must have the same length, and offset is the
+    position of the region within the checksummed buffer.  This is
+    RFC 1624 eqn. 3, HC' = ~(~HC + ~m + m'), applied to the whole region.
+    '''
+    total = (~checksum & 0xffff) + word_sum(new_data, offset)
+    old_total = word_sum(old_data, offset)
+    # Subtracting in ones' complement is adding the complement; pad the
+    # old sum out to a multiple of 0xffff so the result stays positive.
+    total += (0xffff * ((old_total // 0xffff) + 1)) - old_total
+    return finish(total)
@@ -30,8 +30,13 @@ from . import __version__
 from . import packets
 from . import monotonic_clock
 from . import best_poller
+from . import batch_io
+from . import scheduler
+from . import workers
+from . import fuzz
+from .random_pool import pool as random_pool
 from .args import parse_args
-from .utils import _, _pl, lazy_div, int_to_bytearray, bytearray_to_int, platform_info, twoping_checksum
+from .utils import _, _pl, lazy_div, platform_info
 
 try:
     random_sys = random.SystemRandom()
@@ -46,23 +51,36 @@ try:
 except ImportError:
     has_dns = False
 
+try:
+    from . import asyncio_engine
+    has_asyncio = True
+except ImportError:
+    has_asyncio = False
+
 version_string = '2ping %s - %s' % (__version__, platform_info())
 clock = monotonic_clock.clock
 clock_info = monotonic_clock.get_clock_info('clock')
 
 
-class SocketClass():
-    def __init__(self, sock):
-        self.sock = sock
+class PeerState(object):
+    '''State for one peer address of a socket'''
 
+    # __slots__ keeps the per-peer cost down on listeners with many peers.
+    __slots__ = (
+        'address', 'sent_messages', 'seen_messages', 'courtesy_messages', 'ping_position', 'last_activity',
+    )
+
+    def __init__(self, address, now):
+        self.address = address
         # In-flight outbound messages.  Added in the following conditions:
         #   * Outbound packet with OpcodeReplyRequested sent.
         # Removed in following conditions:
         #   * Inbound packet with OpcodeInReplyTo set to it.
         #   * Inbound packet with it in OpcodeInvestigationSeen or OpcodeInvestigationUnseen.
-        #   * Cleanup after 10 minutes.
+        #   * Cleanup after 2 minutes.
         # If it remains for more than <10> seconds, it it sent as part of
         # OpcodeInvestigate with the next outbound packet with OpcodeReplyRequested set.
+        # Keyed by 48-bit integer message ID; the value is (sent time, ping position).
         self.sent_messages = {}
         # Seen inbound messages.  Added in the following conditions:
         #   * Inbound packet with OpcodeReplyRequested set.
@@ -70,18 +88,45 @@ class SocketClass():
         #   * Inbound packet with it in OpcodeInvestigate.
         # Removed in the following conditions:
         #   * Inbound packet with it in OpcodeCourtesyExpiration.
-        #   * Cleanup after 2 minutes.
+        #   * Cleanup after 10 minutes.
+        # Keyed by 48-bit integer message ID; the value is the time seen.
         self.seen_messages = {}
         # Courtesy messages waiting to be sent.  Added in the following conditions:
         #   * Inbound packet with OpcodeInReplyTo set.
         # Removed in the following conditions:
         #   * Outbound packet where there is room to send it as part of OpcodeCourtesyExpiration.
         #   * Cleanup after 2 minutes.
+        # Keyed by 48-bit integer message ID; the value is the time received.
         self.courtesy_messages = {}
-        # Current position of a peer tuple's incrementing ping integer.
-        self.ping_positions = {}
+        # Current position of the peer's incrementing ping integer.
+        self.ping_position = 0
+        # Time of the last packet sent to or received from the peer.
+        self.last_activity = now
+
+    def is_idle(self, now):
+        '''True if nothing is tracked and the peer has been quiet for 10 minutes'''
+        return (
+            (not self.sent_messages) and
+            (not self.seen_messages) and
+            (not self.courtesy_messages) and
+            (now > (self.last_activity + 600.0))
+        )
+
+
+class SocketClass():
+    def __init__(self, sock):
+        self.sock = sock
+        # getsockname() is a system call, so the bound address is looked up
+        # once.
+        self.address = sock.getsockname()
+        # PeerState of each peer, by peer address.  Created on first contact,
+        # and on listeners removed by cleanup once idle.
+        self.peers = {}
         # Used during client mode for the host tuple to send UDP packets to.
         self.client_host = None
+        # While a received batch is processed, outbound (data, address)
+        # tuples are queued here and sent together afterwards.
+        self.send_queue = None
 
         # Statistics
         self.pings_transmitted = 0
@@ -106,6 +151,14 @@ class SocketClass():
     def fileno(self):
         return self.sock.fileno()
 
+    def peer_state(self, peer_address, now):
+        try:
+            peer = self.peers[peer_address]
+        except KeyError:
+            peer = self.peers[peer_address] = PeerState(peer_address, now)
+        peer.last_activity = now
+        return peer
+
 
 class TwoPing():
     def __init__(self, args):
@@ -116,7 +169,10 @@ class TwoPing():
         self.fake_time_generation = random_sys.randint(0, 65535)
 
         self.sock_classes = []
+        # How many of sock_classes are shut down.
+        self.sock_classes_shutdown = 0
         self.poller = best_poller.best_poller()
+        self.batch_io = batch_io.best_batch_io(self.args.batch_size)
 
         self.pings_transmitted = 0
         self.pings_received = 0
@@ -131,8 +187,20 @@ class TwoPing():
         self.rtt_min = 0
         self.rtt_max = 0
         self.rtt_ewma = 0
+        # Exceptions while processing incoming packets, by type name.
+        self.parse_failures = {}
+        # Batched I/O statistics, for --debug.
+        self.recv_batches = 0
+        self.recv_batch_datagrams = 0
+        self.send_batches = 0
+        self.send_batch_datagrams = 0
+
+        self.fuzzer = None
+        if self.args.fuzz:
+            self.fuzzer = fuzz.Fuzzer(self.args.fuzz_seed)
 
-        # Scheduled events
+        # Scheduled events; loop() keeps their times in the scheduler.
+        self.scheduler = scheduler.Scheduler()
         self.next_cleanup = now + 60.0
         self.next_stats = 0
         if self.args.stats:
@@ -161,6 +229,9 @@ class TwoPing():
         if self.args.send_monotonic_clock and (not clock_info.monotonic):
             self.args.send_monotonic_clock = False
 
+        # Outbound packet template, built on first use by base_packet().
+        self.packet_template = None
+
     def print_out(self, *args, **kwargs):
         '''Emulate Python 3's complete print() functionality'''
         if 'sep' not in kwargs:
@@ -212,24 +283,59 @@ class TwoPing():
                 else:
                     self.print_out(error_string)
 
-    def process_incoming_packet(self, sock_class):
-        sock = sock_class.sock
+    def process_incoming_packets(self, sock_class):
+        # The socket is non-blocking, so keep receiving until it is empty
+        # or this wakeup's budget has been used up.
+        received = 0
+        while received < self.args.receive_budget:
+            try:
+                datagrams = self.batch_io.recv(sock_class.sock)
+            except socket.error as e:
+                self.handle_socket_error(e, sock_class)
+                return
+            if not datagrams:
+                return
+            received += len(datagrams)
+            self.process_incoming_datagrams(sock_class, datagrams)
+
+    def process_incoming_datagrams(self, sock_class, datagrams):
+        self.recv_batches += 1
+        self.recv_batch_datagrams += len(datagrams)
+
+        if self.batch_io.batch_size > 1:
+            sock_class.send_queue = []
         try:
-            (data, peer_address) = sock.recvfrom(16384)
-        except socket.error as e:
-            self.handle_socket_error(e, sock_class)
-            return
-        socket_address = sock.getsockname()
-        self.print_debug('Socket address: %s' % repr(socket_address))
-        self.print_debug('Peer address: %s' % repr(peer_address))
-        data = bytearray(data)
+            for (buf, length, peer_address) in datagrams:
+                try:
+                    self.process_incoming_packet(sock_class, memoryview(buf)[:length], peer_address)
+                except Exception as e:
+                    # Tallied by type only; messages carry sizes and offsets.
+                    failure = e.__class__.__name__
+                    self.parse_failures[failure] = self.parse_failures.get(failure, 0) + 1
+                    self.print_out(_('Exception: {error}').format(error=str(e)))
+                    if self.args.debug:
+                        raise
+        finally:
+            send_queue = sock_class.send_queue
+            sock_class.send_queue = None
+            if send_queue:
+                self.sock_send_queue(sock_class, send_queue)
+            # The replies are out, so the receive buffers can be reused.
+            for (buf, length, peer_address) in datagrams:
+                self.batch_io.release(buf)
+
+    def process_incoming_packet(self, sock_class, data, peer_address):
+        if self.args.debug:
+            self.print_debug('Socket address: %s' % repr(sock_class.address))
+            self.print_debug('Peer address: %s' % repr(peer_address))
 
         # Simulate random packet loss.
         if self.args.packet_loss_in and (random.random() < (self.args.packet_loss_in / 100.0)):
             return
-        # Simulate data corruption
+        # Simulate data corruption.  data is a view of a pooled receive
+        # buffer, so fuzz a copy.
         if self.args.fuzz:
-            data = self.fuzz_packet(data)
+            data = self.fuzz_packet(bytearray(data))
 
         # Per-packet options.
         self.packets_received += 1
@@ -237,17 +343,7 @@ class TwoPing():
         calculated_rtt = None
 
         time_begin = clock()
-        peer_tuple = (socket_address, peer_address, sock.type)
-
-        # Preload state tables if the client has not been seen (or has been cleaned).
-        if peer_tuple not in sock_class.seen_messages:
-            sock_class.seen_messages[peer_tuple] = {}
-        if peer_tuple not in sock_class.sent_messages:
-            sock_class.sent_messages[peer_tuple] = {}
-        if peer_tuple not in sock_class.courtesy_messages:
-            sock_class.courtesy_messages[peer_tuple] = {}
-        if peer_tuple not in sock_class.ping_positions:
-            sock_class.ping_positions[peer_tuple] = 0
+        peer = sock_class.peer_state(peer_address, time_begin)
 
         # Load/parse the packet.
         packet_in = packets.Packet()
@@ -274,15 +370,12 @@ class TwoPing():
                 )
                 return
             (test_begin, test_length) = packet_in.opcode_data_positions[packets.OpcodeHMAC.id]
-            test_begin += 2
-            test_length -= 2
-            packet_in.opcodes[packets.OpcodeHMAC.id].key = bytearray(self.args.auth)
-            test_data = data
-            test_data[2:4] = bytearray(2)
-            test_data[test_begin:(test_begin+test_length)] = bytearray(test_length)
-            test_hash = packet_in.opcodes[packets.OpcodeHMAC.id].hash
-            test_hash_calculated = packet_in.calculate_hash(packet_in.opcodes[packets.OpcodeHMAC.id], test_data)
-            if test_hash_calculated != test_hash:
+            (test_valid, test_hash_calculated) = packets.verify_hash(
+                self.args.auth, self.args.auth_digest_index, data,
+                test_begin + 2, test_begin + test_length,
+            )
+            if not test_valid:
+                test_hash = packet_in.opcodes[packets.OpcodeHMAC.id].hash
                 self.errors_received += 1
                 sock_class.errors_received += 1
                 self.print_out(
@@ -297,10 +390,9 @@ class TwoPing():
         # If this is in reply to one of our sent packets, it's a ping reply, so handle it specially.
         if packets.OpcodeInReplyTo.id in packet_in.opcodes:
             replied_message_id = packet_in.opcodes[packets.OpcodeInReplyTo.id].message_id
-            replied_message_id_int = bytearray_to_int(replied_message_id)
-            if replied_message_id_int in sock_class.sent_messages[peer_tuple]:
-                (sent_time, _unused, ping_position) = sock_class.sent_messages[peer_tuple][replied_message_id_int]
-                del(sock_class.sent_messages[peer_tuple][replied_message_id_int])
+            if replied_message_id in peer.sent_messages:
+                (sent_time, ping_position) = peer.sent_messages[replied_message_id]
+                del(peer.sent_messages[replied_message_id])
                 calculated_rtt = (time_begin - sent_time) * 1000
                 self.pings_received += 1
                 sock_class.pings_received += 1
@@ -316,7 +408,7 @@ class TwoPing():
                         self.print_out(
                             _('{bytes} bytes from {address}: ping_seq={seq} time={ms:0.03f} ms peertime={peerms:0.03f} ms').format(
                                 bytes=len(data),
-                                address=peer_tuple[1][0],
+                                address=peer_address[0],
                                 seq=ping_position,
                                 ms=calculated_rtt,
                                 peerms=(packet_in.opcodes[packets.OpcodeRTTEnclosed.id].rtt_us / 1000.0),
@@ -326,7 +418,7 @@ class TwoPing():
                         self.print_out(
                             _('{bytes} bytes from {address}: ping_seq={seq} time={ms:0.03f} ms').format(
                                 bytes=len(data),
-                                address=peer_tuple[1][0],
+                                address=peer_address[0],
                                 seq=ping_position,
                                 ms=calculated_rtt,
                             )
@@ -337,22 +429,21 @@ class TwoPing():
                     ):
                         notice = str(packet_in.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedNotice.id].text)
                         self.print_out('  ' + _('Peer notice: {notice}').format(notice=notice))
-            sock_class.courtesy_messages[peer_tuple][replied_message_id_int] = (time_begin, replied_message_id)
+            peer.courtesy_messages[replied_message_id] = time_begin
 
         # Check if any invesitgations results have come back.
-        self.check_investigations(sock_class, peer_tuple, packet_in)
+        self.check_investigations(sock_class, peer, packet_in)
 
         # Process courtesy expirations
         if packets.OpcodeCourtesyExpiration.id in packet_in.opcodes:
             for message_id in packet_in.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids:
-                message_id_int = bytearray_to_int(message_id)
-                if message_id_int in sock_class.seen_messages[peer_tuple]:
-                    del(sock_class.seen_messages[peer_tuple][message_id_int])
+                if message_id in peer.seen_messages:
+                    del(peer.seen_messages[message_id])
 
         # If the peer requested a reply, prepare one.
         if packets.OpcodeReplyRequested.id in packet_in.opcodes:
             # Populate seen_messages.
-            sock_class.seen_messages[peer_tuple][bytearray_to_int(packet_in.message_id)] = time_begin
+            peer.seen_messages[packet_in.message_id] = time_begin
 
             # Basic packet configuration.
             packet_out = self.base_packet()
@@ -374,7 +465,7 @@ class TwoPing():
             # Check for any investigations the peer requested.
             if packets.OpcodeInvestigate.id in packet_in.opcodes:
                 for message_id in packet_in.opcodes[packets.OpcodeInvestigate.id].message_ids:
-                    if bytearray_to_int(message_id) in sock_class.seen_messages[peer_tuple]:
+                    if message_id in peer.seen_messages:
                         if packets.OpcodeInvestigationSeen.id not in packet_out.opcodes:
                             packet_out.opcodes[packets.OpcodeInvestigationSeen.id] = packets.OpcodeInvestigationSeen()
                         packet_out.opcodes[packets.OpcodeInvestigationSeen.id].message_ids.append(message_id)
@@ -387,14 +478,16 @@ class TwoPing():
             # disabled, request a reply.
             if (packets.OpcodeInReplyTo.id not in packet_in.opcodes) and (not self.args.no_3way):
                 packet_out.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
+                # The reply will be tracked in sent_messages, so don't reuse an ID in flight.
+                packet_out.message_id = packets.new_message_id(peer.sent_messages)
 
             # Send any investigations we would like to know about.
-            self.start_investigations(sock_class, peer_tuple, packet_out)
+            self.start_investigations(sock_class, peer, packet_out)
 
             # Any courtesy expirations we have waiting should be sent.
-            if len(sock_class.courtesy_messages[peer_tuple]) > 0:
+            if len(peer.courtesy_messages) > 0:
                 packet_out.opcodes[packets.OpcodeCourtesyExpiration.id] = packets.OpcodeCourtesyExpiration()
-                for (courtesy_time, courtesy_message_id) in sock_class.courtesy_messages[peer_tuple].values():
+                for courtesy_message_id in peer.courtesy_messages:
                     packet_out.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids.append(courtesy_message_id)
 
             # Calculate the host latency as late as possible.
@@ -403,7 +496,7 @@ class TwoPing():
             packet_out.opcodes[packets.OpcodeHostLatency.id].delay_us = int((time_send - time_begin) * 1000000)
 
             # Dump the packet.
-            dump_out = packet_out.dump()
+            (dump_out, dump_manifest) = packet_out.dump(manifest=True)
 
             # Send the packet.
             self.sock_sendto(sock_class, dump_out, peer_address)
@@ -414,26 +507,20 @@ class TwoPing():
             if packets.OpcodeReplyRequested.id in packet_out.opcodes:
                 self.pings_transmitted += 1
                 sock_class.pings_transmitted += 1
-                sock_class.ping_positions[peer_tuple] += 1
-                sock_class.sent_messages[peer_tuple][bytearray_to_int(packet_out.message_id)] = (
+                peer.ping_position += 1
+                peer.sent_messages[packet_out.message_id] = (
                     time_send,
-                    packet_out.message_id,
-                    sock_class.ping_positions[peer_tuple]
+                    peer.ping_position
                 )
 
-            # Examine the sent packet.
-            packet_out_examine = packets.Packet()
-            packet_out_examine.load(dump_out)
-
             # Any courtesy expirations which had room in the sent packet should be forgotten.
-            if packets.OpcodeCourtesyExpiration.id in packet_out_examine.opcodes:
-                for courtesy_message_id in packet_out_examine.opcodes[packets.OpcodeCourtesyExpiration.id].message_ids:
-                    courtesy_message_id_int = bytearray_to_int(courtesy_message_id)
-                    if courtesy_message_id_int in sock_class.courtesy_messages[peer_tuple]:
-                        del(sock_class.courtesy_messages[peer_tuple][courtesy_message_id_int])
+            if packets.OpcodeCourtesyExpiration.id in dump_manifest.message_ids:
+                for courtesy_message_id in dump_manifest.message_ids[packets.OpcodeCourtesyExpiration.id]:
+                    if courtesy_message_id in peer.courtesy_messages:
+                        del(peer.courtesy_messages[courtesy_message_id])
 
             if self.args.verbose:
-                self.print_out('SEND: %s' % repr(packet_out_examine))
+                self.print_out('SEND: %s' % self.examine_packet(dump_out))
 
         # If we're in flood mode and this is a ping reply, send a new ping ASAP.
         if self.args.flood and (not self.args.listen) and (packets.OpcodeInReplyTo.id in packet_in.opcodes):
@@ -444,22 +531,32 @@ class TwoPing():
         # Simulate random packet loss.
         if self.args.packet_loss_out and (random.random() < (self.args.packet_loss_out / 100.0)):
             return
+        # Queue the packet if a received batch is being processed.
+        if sock_class.send_queue is not None:
+            sock_class.send_queue.append((data, address))
+            return
         # Send the packet.
         try:
-            sock.sendto(data, address)
+            batch_io.sendto(sock, data, address)
         except socket.error as e:
             self.handle_socket_error(e, sock_class, peer_address=address)
 
-    def start_investigations(self, sock_class, peer_tuple, packet_check):
-        if len(sock_class.sent_messages[peer_tuple]) == 0:
+    def sock_send_queue(self, sock_class, send_queue):
+        self.send_batches += 1
+        self.send_batch_datagrams += len(send_queue)
+        for (address, e) in self.batch_io.send(sock_class.sock, send_queue):
+            self.handle_socket_error(e, sock_class, peer_address=address)
+
+    def start_investigations(self, sock_class, peer, packet_check):
+        if len(peer.sent_messages) == 0:
             return
         if packets.OpcodeInvestigate.id in packet_check.opcodes:
             iobj = packet_check.opcodes[packets.OpcodeInvestigate.id]
         else:
             iobj = None
         now = clock()
-        for message_id_str in sock_class.sent_messages[peer_tuple]:
-            (sent_time, message_id, _unused) = sock_class.sent_messages[peer_tuple][message_id_str]
+        for message_id in peer.sent_messages:
+            (sent_time, _unused) = peer.sent_messages[message_id]
             if now >= (sent_time + self.args.inquire_wait):
                 if iobj is None:
                     iobj = packets.OpcodeInvestigate()
@@ -468,30 +565,28 @@ class TwoPing():
         if iobj is not None:
             packet_check.opcodes[packets.OpcodeInvestigate.id] = iobj
 
-    def check_investigations(self, sock_class, peer_tuple, packet_check):
+    def check_investigations(self, sock_class, peer, packet_check):
         found = {}
 
         # Inbound
         if packets.OpcodeInvestigationSeen.id in packet_check.opcodes:
             for message_id in packet_check.opcodes[packets.OpcodeInvestigationSeen.id].message_ids:
-                message_id_int = bytearray_to_int(message_id)
-                if message_id_int not in sock_class.sent_messages[peer_tuple]:
+                if message_id not in peer.sent_messages:
                     continue
-                (_unused, _unused, ping_seq) = sock_class.sent_messages[peer_tuple][message_id_int]
-                found[ping_seq] = ('inbound', peer_tuple[1][0])
-                del(sock_class.sent_messages[peer_tuple][message_id_int])
+                (_unused, ping_seq) = peer.sent_messages[message_id]
+                found[ping_seq] = ('inbound', peer.address[0])
+                del(peer.sent_messages[message_id])
                 self.lost_inbound += 1
                 sock_class.lost_inbound += 1
 
         # Outbound
         if packets.OpcodeInvestigationUnseen.id in packet_check.opcodes:
             for message_id in packet_check.opcodes[packets.OpcodeInvestigationUnseen.id].message_ids:
-                message_id_int = bytearray_to_int(message_id)
-                if message_id_int not in sock_class.sent_messages[peer_tuple]:
+                if message_id not in peer.sent_messages:
                     continue
-                (_unused, _unused, ping_seq) = sock_class.sent_messages[peer_tuple][message_id_int]
-                found[ping_seq] = ('outbound', peer_tuple[1][0])
-                del(sock_class.sent_messages[peer_tuple][message_id_int])
+                (_unused, ping_seq) = peer.sent_messages[message_id]
+                found[ping_seq] = ('outbound', peer.address[0])
+                del(peer.sent_messages[message_id])
                 self.lost_outbound += 1
                 sock_class.lost_outbound += 1
 
@@ -517,8 +612,17 @@ class TwoPing():
                         seq=ping_seq,
                     ))
 
-    def setup_listener(self):
+    def setup_listener(self, socks=None):
+        if socks is None:
+            socks = self.listener_sockets()
+        for sock in socks:
+            sock_class = SocketClass(sock)
+            self.sock_classes.append(sock_class)
+            self.poller.register(sock_class)
+
+    def listener_sockets(self, announce=True):
         bound_addresses = []
+        socks = []
         if self.args.interface_address:
             interface_addresses = self.args.interface_address
         else:
@@ -541,16 +645,16 @@ class TwoPing():
                     pass
                 else:
                     continue
-                sock = self.new_socket(l[0], l[1], l[4])
-                sock_class = SocketClass(sock)
-                self.sock_classes.append(sock_class)
-                self.poller.register(sock_class)
+                socks.append(self.new_socket(l[0], l[1], l[4]))
                 bound_addresses.append(l)
+                if not announce:
+                    continue
                 self.print_out(_('2PING listener ({address}): {min} to {max} bytes of data.').format(
                     address=l[4][0],
                     min=self.args.min_packet_size,
                     max=self.args.max_packet_size,
                 ))
+        return socks
 
     def setup_client(self):
         if self.args.srv:
@@ -638,62 +742,56 @@ class TwoPing():
             )
 
     def fuzz_packet(self, packet):
-        def fuzz_bytearray(data, pct):
-            for p in range(len(data)):
-                xor_byte = 0
-                for i in range(8):
-                    if random.random() < pct:
-                        xor_byte = xor_byte + (2 ** i)
-                data[p] = data[p] ^ xor_byte
-            return data
-
-        fuzz_fraction = self.args.fuzz / 100.0
-
-        # Fuzz the entire packet
-        packet[4:] = fuzz_bytearray(packet[4:], fuzz_fraction)
-
-        # Fuzz the magic number, at a lower probability
-        packet[0:2] = fuzz_bytearray(packet[0:2], fuzz_fraction / 10.0)
-
-        # Fuzz the recalculated checksum itself, at a lower probability
-        packet[2:4] = bytearray(2)
-        packet[2:4] = fuzz_bytearray(int_to_bytearray(twoping_checksum(packet), 2), fuzz_fraction / 10.0)
+        return self.fuzzer.fuzz_packet(packet, self.args.fuzz / 100.0)
 
-        return packet
-
-    def send_new_ping(self, sock_class, peer_address):
-        sock = sock_class.sock
-        socket_address = sock.getsockname()
-        peer_tuple = (socket_address, peer_address, sock.type)
-        if peer_tuple not in sock_class.sent_messages:
-            sock_class.sent_messages[peer_tuple] = {}
-        if peer_tuple not in sock_class.ping_positions:
-            sock_class.ping_positions[peer_tuple] = 0
+    def send_new_ping(self, sock_class, peer_address, count=1):
+        peer = sock_class.peer_state(peer_address, clock())
 
         packet_out = self.base_packet()
         packet_out.opcodes[packets.OpcodeReplyRequested.id] = packets.OpcodeReplyRequested()
-        self.start_investigations(sock_class, peer_tuple, packet_out)
-        dump_out = packet_out.dump()
+        self.start_investigations(sock_class, peer, packet_out)
+        # Message IDs are never reused while in flight, so a sent_messages
+        # entry is never overwritten.
+        if count == 1:
+            packet_out.message_id = packets.new_message_id(peer.sent_messages)
+            dump_outs = [packet_out.dump()]
+            message_ids = [packet_out.message_id]
+        else:
+            # A burst (--preload) is encoded up front, so it leaves as a
+            # tight train of packets.
+            exclude = set(peer.sent_messages)
+            message_ids = []
+            for i in xrange(count):
+                message_ids.append(packets.new_message_id(exclude))
+                exclude.add(message_ids[-1])
+            dump_outs = packet_out.dump_many(message_ids)
         now = clock()
-        self.sock_sendto(sock_class, dump_out, peer_address)
-        self.packets_transmitted += 1
-        sock_class.packets_transmitted += 1
-        self.pings_transmitted += 1
-        sock_class.pings_transmitted += 1
-        sock_class.ping_positions[peer_tuple] += 1
-        sock_class.sent_messages[peer_tuple][bytearray_to_int(packet_out.message_id)] = (
-            now,
-            packet_out.message_id,
-            sock_class.ping_positions[peer_tuple]
-        )
-        packet_out_examine = packets.Packet()
-        packet_out_examine.load(dump_out)
+        for dump_out in dump_outs:
+            self.sock_sendto(sock_class, dump_out, peer_address)
+        self.packets_transmitted += count
+        sock_class.packets_transmitted += count
+        self.pings_transmitted += count
+        sock_class.pings_transmitted += count
+        for message_id in message_ids:
+            peer.ping_position += 1
+            peer.sent_messages[message_id] = (
+                now,
+                peer.ping_position
+            )
         if self.args.quiet:
             pass
         elif self.args.flood:
-            self.print_out('.', end='', flush=True)
+            self.print_out('.' * count, end='', flush=True)
         if self.args.verbose:
-            self.print_out('SEND: %s' % repr(packet_out_examine))
+            for dump_out in dump_outs:
+                self.print_out('SEND: %s' % self.examine_packet(dump_out))
+
+    def examine_packet(self, data):
+        # Only used for verbose output, so the re-parse of what was actually
+        # sent is not paid for otherwise.
+        packet_examine = packets.Packet()
+        packet_examine.load(data)
+        return repr(packet_examine)
 
     def update_rtts(self, sock_class, rtt):
         for c in (self, sock_class):
@@ -746,6 +844,34 @@ class TwoPing():
         else:
             for sock_class in self.sock_classes:
                 self.print_stats_sock(time_end, short=short, sock_class=sock_class)
+        if self.args.fuzz and not (short or self.args.nagios):
+            self.print_stats_fuzz()
+        if not short:
+            self.print_stats_batch_io()
+
+    def print_stats_fuzz(self):
+        self.print_out(_pl(
+            'fuzz seed {seed}, {failures} packet failed to parse',
+            'fuzz seed {seed}, {failures} packets failed to parse',
+            sum(self.parse_failures.values())
+        ).format(
+            seed=self.fuzzer.seed,
+            failures=sum(self.parse_failures.values()),
+        ))
+        for (failure, count) in sorted(self.parse_failures.items(), key=lambda x: (-x[1], x[0])):
+            self.print_out('  %d %s' % (count, failure))
+
+    def print_stats_batch_io(self):
+        self.print_debug('%s: %d receive batches, %0.02f average datagrams per batch' % (
+            self.batch_io.io_type,
+            self.recv_batches,
+            lazy_div(float(self.recv_batch_datagrams), self.recv_batches),
+        ))
+        self.print_debug('%s: %d send batches, %0.02f average datagrams per batch' % (
+            self.batch_io.io_type,
+            self.send_batches,
+            lazy_div(float(self.send_batch_datagrams), self.send_batches),
+        ))
 
     def print_stats_sock(self, time_end, short=False, sock_class=None):
         if sock_class is not None:
@@ -866,7 +992,16 @@ class TwoPing():
 
     def run(self):
         self.print_debug('Clock: %s, value: %f' % (clock_info, clock()))
-        self.print_debug('Poller: %s' % self.poller.poller_type)
+        if (self.args.engine == 'asyncio') and (not has_asyncio):
+            self.print_out(_('asyncio engine not available; please install trollius'))
+            return 1
+        if self.args.workers > 1:
+            if not workers.has_workers:
+                self.print_out(_('Multiple workers require fork() and SO_REUSEPORT'))
+                return 1
+            return workers.Supervisor(self).run()
+        engine = self.new_engine()
+        self.print_debug('Batch I/O: %s (%d datagrams)' % (self.batch_io.io_type, self.batch_io.batch_size))
         if hasattr(signal, 'SIGQUIT'):
             signal.signal(signal.SIGQUIT, self.sigquit_handler)
 
@@ -880,34 +1015,65 @@ class TwoPing():
             return 1
 
         try:
+            if engine is not None:
+                return engine.run()
             self.loop()
         except KeyboardInterrupt:
             self.shutdown()
             return
 
+    def new_engine(self):
+        '''Return the AsyncioEngine to run on, or None for loop()'''
+        if self.args.engine == 'asyncio':
+            engine = asyncio_engine.AsyncioEngine(self)
+            self.print_debug('Engine: asyncio (%s)' % engine.loop_type)
+            return engine
+        self.print_debug('Poller: %s' % self.poller.poller_type)
+        return None
+
     def base_packet(self):
+        if self.packet_template is None:
+            self.packet_template = self.new_packet_template()
+        template_packet = self.packet_template.packet
+        if self.args.send_time:
+            template_packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedWallClock.id].time_us = int(time.time() * 1000000)
+        if self.args.send_monotonic_clock:
+            template_packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id].time_us = int((clock() - self.time_start + self.fake_time_epoch) * 1000000)
+        if self.args.send_random:
+            random_data = random_pool.read(self.args.send_random)
+            template_packet.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedRandom.id].random_data = random_data
+        return self.packet_template.new_packet()
+
+    def new_packet_template(self):
+        # Everything which is the same from packet to packet is built once
+        # here.  The wall clock, monotonic clock and random segments keep
+        # their length and are filled in by base_packet() for each packet.
         packet_out = packets.Packet()
+        dynamic_segments = []
         if (not self.args.no_send_version) or (self.args.notice):
             packet_out.opcodes[packets.OpcodeExtended.id] = packets.OpcodeExtended()
         if not self.args.no_send_version:
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedVersion.id] = packets.ExtendedVersion()
-            packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedVersion.id].text = version_string
+            packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedVersion.id].text = bytearray(version_string)
         if self.args.send_time:
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedWallClock.id] = packets.ExtendedWallClock()
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedWallClock.id].time_us = int(time.time() * 1000000)
+            dynamic_segments.append(packets.ExtendedWallClock.id)
         if self.args.send_monotonic_clock:
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id] = packets.ExtendedMonotonicClock()
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id].generation = self.fake_time_generation
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedMonotonicClock.id].time_us = int((clock() - self.time_start + self.fake_time_epoch) * 1000000)
+            dynamic_segments.append(packets.ExtendedMonotonicClock.id)
         if self.args.send_random:
-            random_data = bytearray([random_sys.randint(0, 255) for x in xrange(self.args.send_random)])
+            random_data = random_pool.read(self.args.send_random)
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedRandom.id] = packets.ExtendedRandom()
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedRandom.id].is_hwrng = False
-            packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedRandom.id].is_os = has_sysrandom
+            packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedRandom.id].is_os = random_pool.is_os
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedRandom.id].random_data = random_data
+            dynamic_segments.append(packets.ExtendedRandom.id)
         if self.args.notice:
             packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedNotice.id] = packets.ExtendedNotice()
-            packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedNotice.id].text = self.args.notice
+            packet_out.opcodes[packets.OpcodeExtended.id].segments[packets.ExtendedNotice.id].text = bytearray(self.args.notice)
         if self.args.auth:
             packet_out.opcodes[packets.OpcodeHMAC.id] = packets.OpcodeHMAC()
             packet_out.opcodes[packets.OpcodeHMAC.id].key = bytearray(self.args.auth)
@@ -915,7 +1081,7 @@ class TwoPing():
         packet_out.padding_pattern = self.args.pattern_bytearray
         packet_out.min_length = self.args.min_packet_size
         packet_out.max_length = self.args.max_packet_size
-        return packet_out
+        return packets.PacketTemplate(packet_out, dynamic_segments=dynamic_segments)
 
     def scheduled_cleanup(self):
         self.print_debug('Cleanup')
@@ -924,33 +1090,32 @@ class TwoPing():
 
     def scheduled_cleanup_sock_class(self, sock_class):
         now = clock()
-        for peer_tuple in sock_class.sent_messages.keys():
-            for message_id_int in sock_class.sent_messages[peer_tuple].keys():
-                if now > (sock_class.sent_messages[peer_tuple][message_id_int][0] + 120.0):
-                    del(sock_class.sent_messages[peer_tuple][message_id_int])
-                    self.print_debug('Cleanup: Removed sent_messages %s %d' % (repr(peer_tuple), message_id_int))
-            if len(sock_class.sent_messages[peer_tuple]) == 0:
-                del(sock_class.sent_messages[peer_tuple])
-                self.print_debug('Cleanup: Removed sent_messages empty %s' % repr(peer_tuple))
-        for peer_tuple in sock_class.seen_messages.keys():
-            for message_id_int in sock_class.seen_messages[peer_tuple].keys():
-                if now > (sock_class.seen_messages[peer_tuple][message_id_int] + 600.0):
-                    del(sock_class.seen_messages[peer_tuple][message_id_int])
-                    self.print_debug('Cleanup: Removed seen_messages %s %d' % (repr(peer_tuple), message_id_int))
-            if len(sock_class.seen_messages[peer_tuple]) == 0:
-                del(sock_class.seen_messages[peer_tuple])
-                self.print_debug('Cleanup: Removed seen_messages empty %s' % repr(peer_tuple))
-        for peer_tuple in sock_class.courtesy_messages.keys():
-            for message_id_int in sock_class.courtesy_messages[peer_tuple].keys():
-                if now > (sock_class.courtesy_messages[peer_tuple][message_id_int][0] + 120.0):
-                    del(sock_class.courtesy_messages[peer_tuple][message_id_int])
-                    self.print_debug('Cleanup: Removed courtesy_messages %s %d' % (repr(peer_tuple), message_id_int))
-            if len(sock_class.courtesy_messages[peer_tuple]) == 0:
-                del(sock_class.courtesy_messages[peer_tuple])
-                self.print_debug('Cleanup: Removed courtesy_messages empty %s' % repr(peer_tuple))
+        for peer in list(sock_class.peers.values()):
+            for message_id_int in list(peer.sent_messages.keys()):
+                if now > (peer.sent_messages[message_id_int][0] + 120.0):
+                    del(peer.sent_messages[message_id_int])
+                    self.print_debug('Cleanup: Removed sent_messages %s %d' % (repr(peer.address), message_id_int))
+            for message_id_int in list(peer.seen_messages.keys()):
+                if now > (peer.seen_messages[message_id_int] + 600.0):
+                    del(peer.seen_messages[message_id_int])
+                    self.print_debug('Cleanup: Removed seen_messages %s %d' % (repr(peer.address), message_id_int))
+            for message_id_int in list(peer.courtesy_messages.keys()):
+                if now > (peer.courtesy_messages[message_id_int] + 120.0):
+                    del(peer.courtesy_messages[message_id_int])
+                    self.print_debug('Cleanup: Removed courtesy_messages %s %d' % (repr(peer.address), message_id_int))
+            # A client socket's one peer is kept, so its ping_seq carries on
+            # however long --interval is.
+            if self.args.listen and peer.is_idle(now):
+                del(sock_class.peers[peer.address])
+                self.print_debug('Cleanup: Removed peer %s' % repr(peer.address))
 
     def new_socket(self, family, type, bind):
         sock = socket.socket(family, type)
+        sock.setblocking(False)
+        if self.args.workers > 1:
+            # Each worker binds the same address; the kernel spreads peers
+            # across them.
+            sock.setsockopt(socket.SOL_SOCKET, workers.SO_REUSEPORT, 1)
         try:
             import IN
             sock.setsockopt(socket.IPPROTO_IP, IN.IP_RECVERR, int(True))
@@ -965,56 +1130,88 @@ class TwoPing():
         self.print_debug('Bound to: %s' % repr((family, type, bind)))
         return sock
 
+    def scheduled_send(self, sock_class, now):
+        if sock_class.is_shutdown:
+            return
+        if now < sock_class.next_send:
+            return
+        if self.args.count and (sock_class.pings_transmitted >= self.args.count):
+            self.shutdown_sock_class(sock_class)
+            return
+        if (sock_class.pings_transmitted == 0) and (self.args.preload > 1):
+            self.send_new_ping(sock_class, sock_class.client_host[4], count=self.args.preload)
+        else:
+            self.send_new_ping(sock_class, sock_class.client_host[4])
+        sock_class.next_send = now + self.args.interval
+
+    def incoming_packets_done(self, sock_class, now):
+        if self.args.adaptive and sock_class.rtt_ewma:
+            target = sock_class.rtt_ewma / 8.0 / 1000.0
+            sock_class.next_send = now + target
+        if (
+            self.args.count and
+            (sock_class.pings_transmitted >= self.args.count) and
+            (sock_class.pings_transmitted == sock_class.pings_received)
+        ):
+            self.shutdown_sock_class(sock_class)
+
+    def shutdown_sock_class(self, sock_class):
+        if sock_class.is_shutdown:
+            return
+        sock_class.is_shutdown = True
+        self.sock_classes_shutdown += 1
+
+    def all_shutdown(self):
+        return self.sock_classes_shutdown >= len(self.sock_classes)
+
+    def schedule_send(self, sock_class, now):
+        '''(Re)schedule sock_class for its next_send'''
+        if sock_class.is_shutdown:
+            self.scheduler.cancel(sock_class)
+            return
+        if self.args.flood and (now + 0.01 < sock_class.next_send):
+            sock_class.next_send = now + 0.01
+        self.scheduler.schedule(sock_class, sock_class.next_send)
+
     def loop(self):
+        # Only due events are handled on each wakeup, so the cost does not
+        # grow with the number of client sockets.
+        timers = self.scheduler
+        timers.schedule('cleanup', self.next_cleanup)
+        if self.args.stats:
+            timers.schedule('stats', self.next_stats)
+        if self.args.deadline:
+            timers.schedule('deadline', self.time_start + self.args.deadline)
+        if not self.args.listen:
+            for sock_class in self.sock_classes:
+                timers.schedule(sock_class, sock_class.next_send)
+
         while True:
             now = clock()
-            if now >= self.next_cleanup:
-                self.scheduled_cleanup()
-                self.next_cleanup = now + 60.0
-            if not self.args.listen:
-                for sock_class in self.sock_classes:
-                    if sock_class.is_shutdown:
-                        continue
-                    if now >= sock_class.next_send:
-                        if self.args.count and (sock_class.pings_transmitted >= self.args.count):
-                            sock_class.is_shutdown = True
-                            continue
-                        if (sock_class.pings_transmitted == 0) and (self.args.preload > 1):
-                            for i in xrange(self.args.preload):
-                                self.send_new_ping(sock_class, sock_class.client_host[4])
-                        else:
-                            self.send_new_ping(sock_class, sock_class.client_host[4])
-                        sock_class.next_send = now + self.args.interval
-
-            if self.args.flood:
-                next_send = now + 0.01
-                for sock_class in self.sock_classes:
-                    if next_send < sock_class.next_send:
-                        sock_class.next_send = next_send
+            for key in timers.pop_due(now):
+                if key == 'cleanup':
+                    self.scheduled_cleanup()
+                    self.next_cleanup = now + 60.0
+                    timers.schedule('cleanup', self.next_cleanup)
+                elif key == 'stats':
+                    self.print_stats(short=True)
+                    self.next_stats = now + self.args.stats
+                    timers.schedule('stats', self.next_stats)
+                elif key == 'deadline':
+                    self.shutdown()
+                else:
+                    self.scheduled_send(key, now)
+                    self.schedule_send(key, now)
+            if self.all_shutdown():
+                self.shutdown()
 
             next_wakeup = now + self.old_age_interval
             next_wakeup_reason = 'old age'
-            for sock_class in self.sock_classes:
-                if (not self.args.listen) and (sock_class.next_send < next_wakeup):
-                    next_wakeup = sock_class.next_send
+            pending = timers.peek()
+            if (pending is not None) and (pending[0] < next_wakeup):
+                (next_wakeup, next_wakeup_reason) = pending
+                if isinstance(next_wakeup_reason, SocketClass):
                     next_wakeup_reason = 'send'
-            if self.args.stats:
-                if now >= self.next_stats:
-                    self.print_stats(short=True)
-                    self.next_stats = now + self.args.stats
-                if self.next_stats < next_wakeup:
-                    next_wakeup = self.next_stats
-                    next_wakeup_reason = 'stats'
-            if self.args.deadline:
-                time_deadline = self.time_start + self.args.deadline
-                if now >= time_deadline:
-                    self.shutdown()
-                if time_deadline < next_wakeup:
-                    next_wakeup = time_deadline
-                    next_wakeup_reason = 'deadline'
-            if self.next_cleanup < next_wakeup:
-                next_wakeup = self.next_cleanup
-                next_wakeup_reason = 'cleanup'
 
             if next_wakeup < now:
                 next_wakeup = now
@@ -1022,30 +1219,12 @@ class TwoPing():
             self.print_debug('Next wakeup: %s (%s)' % ((next_wakeup - now), next_wakeup_reason))
 
             for sock_class in self.poller.poll(next_wakeup - now):
-                try:
-                    self.process_incoming_packet(sock_class)
-                except Exception as e:
-                    self.print_out(_('Exception: {error}').format(error=str(e)))
-                    if self.args.debug:
-                        raise
-
-                if self.args.adaptive and sock_class.rtt_ewma:
-                    target = sock_class.rtt_ewma / 8.0 / 1000.0
-                    sock_class.next_send = now + target
-                if (
-                    self.args.count and
-                    (sock_class.pings_transmitted >= self.args.count) and
-                    (sock_class.pings_transmitted == sock_class.pings_received)
-                ):
-                    sock_class.is_shutdown = True
-
-            all_shutdown = True
-            for sock_class in self.sock_classes:
-                if not sock_class.is_shutdown:
-                    all_shutdown = False
-                    break
-            if all_shutdown:
-                self.shutdown()
+                self.process_incoming_packets(sock_class)
+                self.incoming_packets_done(sock_class, now)
+                if not self.args.listen:
+                    # A reply may have brought the next send forward (--flood,
+                    # --adaptive) or finished the socket (--count).
+                    self.schedule_send(sock_class, now)
 
 
 def main():
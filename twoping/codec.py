@@ -0,0 +1,117 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# Fixed-width big-endian integer encoders and decoders.
+#
+# pack_uintN() returns a new bytearray (copying struct's str output is
+# cheaper than pack_into() on a fresh buffer), pack_uintN_into() writes
+# into an existing buffer, and unpack_uintN() reads from anything
+# supporting the buffer interface (bytearray, memoryview, str).  48-bit
+# integers (2ping message IDs) are handled as a 16-bit high and 32-bit
+# low half.  unpack_partial() wraps a decoder for fields which may be cut
+# short by the end of the data.
+
+from __future__ import print_function, division
+import struct
+
+uint16_struct = struct.Struct('!H')
+uint32_struct = struct.Struct('!L')
+uint48_struct = struct.Struct('!HL')
+uint64_struct = struct.Struct('!Q')
+
+
+def pack_uint16(i):
+    return bytearray(uint16_struct.pack(i))
+
+
+def pack_uint16_into(buf, offset, i):
+    uint16_struct.pack_into(buf, offset, i)
+
+
+def unpack_uint16(data, offset=0):
+    return uint16_struct.unpack_from(data, offset)[0]
+
+
+def pack_uint32(i):
+    return bytearray(uint32_struct.pack(i))
+
+
+def pack_uint32_into(buf, offset, i):
+    uint32_struct.pack_into(buf, offset, i)
+
+
+def unpack_uint32(data, offset=0):
+    return uint32_struct.unpack_from(data, offset)[0]
+
+
+def pack_uint48(i):
+    return bytearray(uint48_struct.pack(i >> 32, i & 0xffffffff))
+
+
+def pack_uint48_into(buf, offset, i):
+    uint48_struct.pack_into(buf, offset, i >> 32, i & 0xffffffff)
+
+
+def unpack_uint48(data, offset=0):
+    (high, low) = uint48_struct.unpack_from(data, offset)
+    return (high << 32) | low
+
+
+def pack_uint64(i):
+    return bytearray(uint64_struct.pack(i))
+
+
+def pack_uint64_into(buf, offset, i):
+    uint64_struct.pack_into(buf, offset, i)
+
+
+def unpack_uint64(data, offset=0):
+    return uint64_struct.unpack_from(data, offset)[0]
+
+
+def unpack_partial(unpack, data, offset, length):
+    '''unpack(data, offset), or if data ends within the field, the
+    big-endian value of the bytes which are there'''
+    if len(data) >= (offset + length):
+        return unpack(data, offset)
+    i = 0
+    for x in bytearray(data[offset:(offset + length)]):
+        i = (i << 8) + x
+    return i
+
+
+if __name__ == '__main__':
+    import timeit
+    from .utils import int_to_bytearray, bytearray_to_int
+
+    number = 200000
+    d = dict((x, bytearray(b'\x12\x34\x56\x78\x9a\xbc\xde\xf0'[0:x])) for x in (2, 4, 6, 8))
+    tests = (
+        ('uint16 encode', lambda: int_to_bytearray(0x1234, 2), lambda: pack_uint16(0x1234)),
+        ('uint32 encode', lambda: int_to_bytearray(0x12345678, 4), lambda: pack_uint32(0x12345678)),
+        ('uint48 encode', lambda: int_to_bytearray(0x123456789abc, 6), lambda: pack_uint48(0x123456789abc)),
+        ('uint64 encode', lambda: int_to_bytearray(0x123456789abcdef0, 8), lambda: pack_uint64(0x123456789abcdef0)),
+        ('uint16 decode', lambda: bytearray_to_int(d[2]), lambda: unpack_uint16(d[2])),
+        ('uint32 decode', lambda: bytearray_to_int(d[4]), lambda: unpack_uint32(d[4])),
+        ('uint48 decode', lambda: bytearray_to_int(d[6]), lambda: unpack_uint48(d[6])),
+        ('uint64 decode', lambda: bytearray_to_int(d[8]), lambda: unpack_uint64(d[8])),
+    )
+    for (name, old, new) in tests:
+        old_time = min(timeit.repeat(old, number=number, repeat=3)) / number * 1000000000
+        new_time = min(timeit.repeat(new, number=number, repeat=3)) / number * 1000000000
+        print('%s: %6.0f ns -> %6.0f ns (%0.1fx)' % (name, old_time, new_time, old_time / new_time))
@@ -21,6 +21,7 @@
 from __future__ import print_function
 import binascii
 import copy
+from .codec import pack_uint32
 
 digest_size = 4
 
@@ -38,22 +39,13 @@ class CRC32():
         return copy.copy(self)
 
     def update(self, buf):
-        self._crc = binascii.crc32(bytes(buf), self._crc)
+        self._crc = binascii.crc32(buf, self._crc)
 
     def clear(self):
         self._crc = 0
 
     def digest(self):
-        i = self._crc & 0xffffffff
-        out = bytearray()
-        while i >= 256:
-            out.insert(0, i & 0xff)
-            i = i >> 8
-        out.insert(0, i)
-        out_len = len(out)
-        if out_len < 4:
-            out = bytearray(4 - out_len) + out
-        return out
+        return pack_uint32(self._crc & 0xffffffff)
 
     def hexdigest(self):
         return ''.join('{hex:02x}'.format(hex=x) for x in self.digest())
@@ -0,0 +1,89 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# Packet fuzzing for --fuzz.
+#
+# Each bit is flipped independently with the given probability.  Rather
+# than drawing a random number per bit, the gap to the next flipped bit
+# is drawn from the matching geometric distribution, so the number of
+# random draws is proportional to the number of flipped bits.  All draws
+# come from one random.Random, so a seed replays the same corruption.
+
+from __future__ import print_function, division
+import math
+import random
+from .checksum import twoping_checksum
+from .codec import pack_uint16_into
+
+
+class Fuzzer():
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def fuzz_bits(self, data, fraction, begin=0, end=None):
+        '''Flip each bit of data[begin:end] in place with probability fraction'''
+        if end is None:
+            end = len(data)
+        if fraction <= 0 or begin >= end:
+            return
+        end_bit = end * 8
+        if fraction >= 1:
+            for pos in xrange(begin, end):
+                data[pos] ^= 0xff
+            return
+        # log1p() keeps tiny fractions from rounding to log(1.0) == 0; one
+        # still too small to register flips nothing.
+        log_q = math.log1p(-fraction)
+        if log_q == 0:
+            return
+        rand = self.random.random
+        bit = begin * 8
+        while True:
+            # Compared before int(), as the gap can be inf.
+            gap = math.log(1.0 - rand()) / log_q
+            if gap >= (end_bit - bit):
+                return
+            bit += int(gap)
+            data[bit >> 3] ^= 1 << (bit & 7)
+            bit += 1
+
+    def fuzz_packet(self, packet, fraction):
+        # Fuzz the entire packet
+        self.fuzz_bits(packet, fraction, 4)
+
+        # Fuzz the magic number, at a lower probability
+        self.fuzz_bits(packet, fraction / 10.0, 0, 2)
+
+        # Fuzz the recalculated checksum itself, at a lower probability
+        pack_uint16_into(packet, 2, 0)
+        pack_uint16_into(packet, 2, twoping_checksum(packet))
+        self.fuzz_bits(packet, fraction / 10.0, 2, 4)
+
+        return packet
+
+
+if __name__ == '__main__':
+    import timeit
+    data = bytearray(512)
+    fuzzer = Fuzzer(0)
+    for fraction in (0.001, 0.01, 0.1):
+        t = min(timeit.repeat(lambda: fuzzer.fuzz_packet(data, fraction), number=1000, repeat=3))
+        print('%d-byte packet at %0.1f%%: %0.0f packets/s' % (len(data), fraction * 100, 1000 / t))
@@ -17,35 +17,129 @@
 # 02110-1301, USA.
 
 from __future__ import print_function, division
-import random
 import hmac
 import time
+import struct
 from . import crc32
-from .utils import twoping_checksum, int_to_bytearray, bytearray_to_int
+from . import checksum
+from .random_pool import pool as random_pool
+from .codec import pack_uint16, pack_uint16_into, pack_uint32, pack_uint48, pack_uint48_into, pack_uint64
+from .codec import unpack_uint16, unpack_uint32, unpack_uint48, unpack_uint64, unpack_partial
 import hashlib
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+# Precompiled wire layouts.  Parsing is done with unpack_from() against a
+# memoryview of the received buffer, so no intermediate slices of the
+# packet are created for headers or fixed-width fields.  Opcodes and
+# segments are decoded on first access, after the packet has been
+# accepted, so their fields tolerate being cut short rather than raising.
+header_struct = struct.Struct('!2sHHLH')
+opcode_header_struct = struct.Struct('!H')
+segment_header_struct = struct.Struct('!LH')
+monotonic_clock_struct = struct.Struct('!HQ')
+
+magic_number = b'2P'
+opcode_flags_all = tuple(1 << x for x in xrange(16))
+
+
+class LazyMap(MutableMapping):
+    '''Mapping whose values are decoded on first access
+
+    positions maps each key to the (position, length) of its encoded value
+    within data, and decoder(key, view) creates the value.  Lookups decode
+    only the key asked for; anything which walks the whole mapping
+    (iteration, keys(), values(), copy(), ==, repr()) decodes everything
+    first.  This is not a dict subclass, as dict(x) and dict's own methods
+    would read the decoded entries directly and miss the pending ones.
+    '''
+
+    __slots__ = ('data', 'pending', 'decoded', 'decoder')
+
+    def __init__(self, data, positions, decoder):
+        self.data = data
+        self.pending = dict(positions)
+        self.decoded = {}
+        self.decoder = decoder
+
+    def __getitem__(self, key):
+        try:
+            return self.decoded[key]
+        except KeyError:
+            pass
+        (pos, length) = self.pending.pop(key)
+        value = self.decoded[key] = self.decoder(key, self.data[pos:(pos+length)])
+        return value
+
+    def __contains__(self, key):
+        return (key in self.decoded) or (key in self.pending)
+
+    has_key = __contains__
+
+    def __setitem__(self, key, value):
+        self.pending.pop(key, None)
+        self.decoded[key] = value
+
+    def __delitem__(self, key):
+        if key in self.pending:
+            del(self.pending[key])
+        else:
+            del(self.decoded[key])
 
+    def decode_all(self):
+        for key in list(self.pending.keys()):
+            self[key]
+
+    def __iter__(self):
+        self.decode_all()
+        return iter(self.decoded)
+
+    def __len__(self):
+        return len(self.decoded) + len(self.pending)
+
+    def __repr__(self):
+        self.decode_all()
+        return repr(self.decoded)
+
+    def clear(self):
+        self.pending.clear()
+        self.decoded.clear()
+
+    def copy(self):
+        '''Return a dict of every entry'''
+        self.decode_all()
+        return self.decoded.copy()
 
-class Extended():
-    id = None
+
+class Extended(object):
+    # Known segments override id with a class attribute; generic segments
+    # carry their ID in the instance.
+    __slots__ = ('id', 'data')
 
     def __init__(self):
+        self.id = None
         self.data = bytearray()
 
     def __repr__(self):
         if self.id is None:
             return '<Extended: %d bytes>' % len(self.data)
         else:
-            id_hex = ''.join(['%02x' % x for x in int_to_bytearray(self.id, 2)])
+            id_hex = ''.join(['%02x' % x for x in pack_uint32(self.id)])
             return '<Extended (0x%s): %d bytes>' % (id_hex, len(self.data))
 
     def load(self, data):
-        self.data = data
+        self.data = bytearray(data)
 
     def dump(self):
         return self.data
 
 
 class ExtendedText(Extended):
+    __slots__ = ('text',)
+    id = None
+
     def __init__(self):
         self.text = bytearray()
 
@@ -53,7 +147,7 @@ class ExtendedText(Extended):
         return '<Text (Generic): %s>' % str(self.text)
 
     def load(self, data):
-        self.text = data
+        self.text = bytearray(data)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < len(self.text)):
@@ -62,6 +156,7 @@ class ExtendedText(Extended):
 
 
 class ExtendedVersion(ExtendedText):
+    __slots__ = ()
     id = 0x3250564e
 
     def __repr__(self):
@@ -69,6 +164,7 @@ class ExtendedVersion(ExtendedText):
 
 
 class ExtendedNotice(ExtendedText):
+    __slots__ = ()
     id = 0xa837b44e
 
     def __repr__(self):
@@ -76,6 +172,7 @@ class ExtendedNotice(ExtendedText):
 
 
 class ExtendedWallClock(Extended):
+    __slots__ = ('time_us',)
     id = 0x64f69319
 
     def __init__(self):
@@ -85,15 +182,16 @@ class ExtendedWallClock(Extended):
         return '<Wall Clock: %s>' % time.strftime('%c', time.gmtime(self.time_us / 1000000.0))
 
     def load(self, data):
-        self.time_us = bytearray_to_int(data[0:8])
+        self.time_us = unpack_partial(unpack_uint64, data, 0, 8)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < 8):
             return None
-        return int_to_bytearray(self.time_us, 8)
+        return pack_uint64(self.time_us)
 
 
 class ExtendedMonotonicClock(Extended):
+    __slots__ = ('generation', 'time_us')
     id = 0x771d8dfb
 
     def __init__(self):
@@ -104,16 +202,20 @@ class ExtendedMonotonicClock(Extended):
         return '<Monotonic Clock: %0.9f, gen %d>' % ((self.time_us / 1000000.0), self.generation)
 
     def load(self, data):
-        self.generation = bytearray_to_int(data[0:2])
-        self.time_us = bytearray_to_int(data[2:10])
+        if len(data) >= monotonic_clock_struct.size:
+            (self.generation, self.time_us) = monotonic_clock_struct.unpack_from(data)
+        else:
+            self.generation = unpack_partial(unpack_uint16, data, 0, 2)
+            self.time_us = unpack_partial(unpack_uint64, data, 2, 8)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < 10):
             return None
-        return int_to_bytearray(self.generation, 2) + int_to_bytearray(self.time_us, 8)
+        return bytearray(monotonic_clock_struct.pack(self.generation, self.time_us))
 
 
 class ExtendedRandom(Extended):
+    __slots__ = ('is_hwrng', 'is_os', 'random_data')
     id = 0x2ff6ad68
 
     def __init__(self):
@@ -130,10 +232,10 @@ class ExtendedRandom(Extended):
         )
 
     def load(self, data):
-        flags = bytearray_to_int(data[0:2])
+        flags = unpack_partial(unpack_uint16, data, 0, 2)
         self.is_hwrng = bool(flags & 0x0001)
         self.is_os = bool(flags & 0x0002)
-        self.random_data = data[2:]
+        self.random_data = bytearray(data[2:])
 
     def dump(self, max_length=None):
         random_data = self.random_data
@@ -149,30 +251,34 @@ class ExtendedRandom(Extended):
             flags = flags | 0x0001
         if self.is_os:
             flags = flags | 0x0002
-        return int_to_bytearray(flags, 2) + random_data
+        return pack_uint16(flags) + random_data
 
 
-class Opcode():
-    id = None
+class Opcode(object):
+    # Known opcodes override id with a class attribute; generic opcodes
+    # carry their flag in the instance.
+    __slots__ = ('id', 'data')
 
     def __init__(self):
+        self.id = None
         self.data = bytearray()
 
     def __repr__(self):
         if self.id is None:
             return '<Opcode: %d bytes>' % len(self.data)
         else:
-            id_hex = ''.join(['%02x' % x for x in int_to_bytearray(self.id, 2)])
+            id_hex = ''.join(['%02x' % x for x in pack_uint16(self.id)])
             return '<Opcode (0x%s): %d bytes>' % (id_hex, len(self.data))
 
     def load(self, data):
-        self.data = data
+        self.data = bytearray(data)
 
     def dump(self):
         return self.data
 
 
 class OpcodeReplyRequested(Opcode):
+    __slots__ = ()
     id = 0x0001
 
     def __init__(self):
@@ -189,25 +295,26 @@ class OpcodeReplyRequested(Opcode):
 
 
 class OpcodeInReplyTo(Opcode):
+    __slots__ = ('message_id',)
     id = 0x0002
 
     def __init__(self):
-        self.message_id = bytearray()
+        self.message_id = 0
 
     def __repr__(self):
-        message_id_hex = ''.join(['%02x' % x for x in self.message_id])
-        return '<In Reply To: 0x%s>' % message_id_hex
+        return '<In Reply To: 0x%012x>' % self.message_id
 
     def load(self, data):
-        self.message_id = data[0:6]
+        self.message_id = unpack_partial(unpack_uint48, data, 0, 6)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < 6):
             return None
-        return self.message_id
+        return pack_uint48(self.message_id)
 
 
 class OpcodeRTTEnclosed(Opcode):
+    __slots__ = ('rtt_us',)
     id = 0x0004
 
     def __init__(self):
@@ -217,28 +324,31 @@ class OpcodeRTTEnclosed(Opcode):
         return '<RTT Enclosed: %d us>' % self.rtt_us
 
     def load(self, data):
-        self.rtt_us = bytearray_to_int(data[0:4])
+        self.rtt_us = unpack_partial(unpack_uint32, data, 0, 4)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < 4):
             return None
-        return int_to_bytearray(self.rtt_us, 4)
+        return pack_uint32(self.rtt_us)
 
 
 class OpcodeMessageIDList(Opcode):
+    __slots__ = ('message_ids',)
+    id = None
+
     def __init__(self):
         self.message_ids = []
 
     def __repr__(self):
-        ids = ['0x%s' % ''.join(['%02x' % x for x in y]) for y in self.message_ids]
+        ids = ['0x%012x' % x for x in self.message_ids]
         return '<ID List (Generic): [%s] (%d)>' % (', '.join(ids), len(self.message_ids))
 
     def load(self, data):
         self.message_ids = []
-        pos = 2
-        for i in xrange(bytearray_to_int(data[0:2])):
-            self.message_ids.append(data[pos:pos+6])
-            pos += 6
+        # Ignore any IDs claimed beyond the end of the opcode data.
+        count = min(unpack_partial(unpack_uint16, data, 0, 2), int((len(data) - 2) / 6))
+        for pos in xrange(2, 2 + (count * 6), 6):
+            self.message_ids.append(unpack_uint48(data, pos))
 
     def dump(self, max_length=None):
         if (max_length is not None):
@@ -248,74 +358,79 @@ class OpcodeMessageIDList(Opcode):
         else:
             output_ids = self.message_ids
 
-        out = int_to_bytearray(len(output_ids), 2)
+        out = pack_uint16(len(output_ids))
         for i in output_ids:
-            out += i
+            out += pack_uint48(i)
         return out
 
 
 class OpcodeInvestigationSeen(OpcodeMessageIDList):
+    __slots__ = ()
     id = 0x0008
 
     def __repr__(self):
-        ids = ['0x%s' % ''.join(['%02x' % x for x in y]) for y in self.message_ids]
+        ids = ['0x%012x' % x for x in self.message_ids]
         return '<Investigation Seen: [%s] (%d)>' % (', '.join(ids), len(self.message_ids))
 
 
 class OpcodeInvestigationUnseen(OpcodeMessageIDList):
+    __slots__ = ()
     id = 0x0010
 
     def __repr__(self):
-        ids = ['0x%s' % ''.join(['%02x' % x for x in y]) for y in self.message_ids]
+        ids = ['0x%012x' % x for x in self.message_ids]
         return '<Investigation Unseen: [%s] (%d)>' % (', '.join(ids), len(self.message_ids))
 
 
 class OpcodeInvestigate(OpcodeMessageIDList):
+    __slots__ = ()
     id = 0x0020
 
     def __repr__(self):
-        ids = ['0x%s' % ''.join(['%02x' % x for x in y]) for y in self.message_ids]
+        ids = ['0x%012x' % x for x in self.message_ids]
         return '<Investigate: [%s] (%d)>' % (', '.join(ids), len(self.message_ids))
 
 
 class OpcodeCourtesyExpiration(OpcodeMessageIDList):
+    __slots__ = ()
     id = 0x0040
 
     def __repr__(self):
-        ids = ['0x%s' % ''.join(['%02x' % x for x in y]) for y in self.message_ids]
+        ids = ['0x%012x' % x for x in self.message_ids]
         return '<Courtesy Expiration: [%s] (%d)>' % (', '.join(ids), len(self.message_ids))
 
 
 class OpcodeHMAC(Opcode):
+    __slots__ = ('key', 'digest_index', 'hash')
     id = 0x0080
+    digest_map = {
+        1: (hashlib.md5, 16),
+        2: (hashlib.sha1, 20),
+        3: (hashlib.sha256, 32),
+        4: (crc32, 4),
+    }
 
     def __init__(self):
         self.key = bytearray()
         self.digest_index = None
         self.hash = bytearray()
 
-        self.digest_map = {
-            1: (hashlib.md5, 16),
-            2: (hashlib.sha1, 20),
-            3: (hashlib.sha1, 30),
-            4: (crc32, 4),
-        }
-
     def __repr__(self):
         return '<HMAC>'
 
     def load(self, data):
-        self.digest_index = bytearray_to_int(data[0:2])
-        self.hash = data[2:]
+        self.digest_index = unpack_partial(unpack_uint16, data, 0, 2)
+        self.hash = bytearray(data[2:])
 
     def dump(self, max_length=None):
         if self.digest_index is not None:
             (hasher, size) = self.digest_map[self.digest_index]
-            return int_to_bytearray(self.digest_index, 2) + bytearray(size)
+            return pack_uint16(self.digest_index) + bytearray(size)
         return None
 
 
 class OpcodeHostLatency(Opcode):
+    __slots__ = ('delay_us',)
     id = 0x0100
 
     def __init__(self):
@@ -325,15 +440,16 @@ class OpcodeHostLatency(Opcode):
         return '<Host Latency: %d us>' % self.delay_us
 
     def load(self, data):
-        self.delay_us = bytearray_to_int(data[0:4])
+        self.delay_us = unpack_partial(unpack_uint32, data, 0, 4)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < 4):
             return None
-        return int_to_bytearray(self.delay_us, 4)
+        return pack_uint32(self.delay_us)
 
 
 class OpcodeExtended(Opcode):
+    __slots__ = ('segments', 'segment_data_positions')
     id = 0x8000
 
     def __init__(self):
@@ -344,39 +460,26 @@ class OpcodeExtended(Opcode):
         return '<Extended: %s>' % repr(sorted(self.segments.values(), key=lambda x: x.id))
 
     def load(self, data):
-        self.segments = {}
         self.segment_data_positions = {}
 
+        if not isinstance(data, memoryview):
+            data = memoryview(data)
+        data_length = len(data)
         pos = 0
-        known_segments = (
-            ExtendedVersion,
-            ExtendedNotice,
-            ExtendedMonotonicClock,
-            ExtendedWallClock,
-            ExtendedRandom,
-        )
-
-        while pos < len(data):
-            flag = bytearray_to_int(data[pos:pos+4])
-            pos += 4
-            segment_data_length = bytearray_to_int(data[pos:pos+2])
-            pos += 2
-            self.segment_data_positions[flag] = (pos, segment_data_length)
-            segment_handler = None
-            for seg in known_segments:
-                if flag == seg.id:
-                    segment_handler = seg
-                    break
-            if segment_handler is None:
-                segment_handler = Extended
-                segment_handler.id = flag
-            self.segments[flag] = segment_handler()
-            self.segments[flag].load(data[pos:(pos+segment_data_length)])
+        # A partial segment header at the end is ignored, and a segment
+        # whose data runs past the end gets what is there.
+        while (pos + 6) <= data_length:
+            (flag, segment_data_length) = segment_header_struct.unpack_from(data, pos)
+            pos += 6
+            self.segment_data_positions[flag] = (pos, min(segment_data_length, data_length - pos))
             pos += segment_data_length
+        # Segments are only decoded when looked up.
+        self.segments = LazyMap(data, self.segment_data_positions, load_segment)
 
     def dump(self, max_length=None):
         if (max_length is not None) and (max_length < 6):
             return None
+        self.segment_data_positions = {}
         out = bytearray()
         pos = 0
         for segment in self.segments.values():
@@ -387,10 +490,9 @@ class OpcodeExtended(Opcode):
             segment_data = segment.dump(max_length=segment_max_length)
             if segment_data is None:
                 continue
-            out += int_to_bytearray(segment.id, 4)
-            pos += 4
-            out += int_to_bytearray(len(segment_data), 2)
-            pos += 2
+            out += segment_header_struct.pack(segment.id, len(segment_data))
+            pos += 6
+            self.segment_data_positions[segment.id] = (pos, len(segment_data))
             out += segment_data
             pos += len(segment_data)
         if len(out) == 0:
@@ -398,116 +500,533 @@ class OpcodeExtended(Opcode):
         return out
 
 
-class Packet():
+# Pre-keyed HMAC (inner, outer) hash objects by (key, digest index).
+# Keying an HMAC hashes both key pads, so this is done once per key and
+# each hash starts from copies of the keyed objects.
+hmac_contexts = {}
+
+
+def hmac_context(key, digest_index):
+    '''Return the shared pre-keyed (inner, outer) hash objects
+
+    The objects must be copied before they are updated.
+    '''
+    key = bytes(key)
+    try:
+        return hmac_contexts[(key, digest_index)]
+    except KeyError:
+        (hasher, size) = OpcodeHMAC.digest_map[digest_index]
+        keyed = hmac.new(key, digestmod=hasher)
+        context = hmac_contexts[(key, digest_index)] = (keyed.inner, keyed.outer)
+        return context
+
+
+def calculate_hash(key, digest_index, payload):
+    (inner, outer) = hmac_context(key, digest_index)
+    inner = inner.copy()
+    inner.update(payload)
+    outer = outer.copy()
+    outer.update(inner.digest())
+    return bytearray(outer.digest())
+
+
+try:
+    compare_digest = hmac.compare_digest
+except AttributeError:
+    # Python < 2.7.7
+    def compare_digest(a, b):
+        a = bytearray(a)
+        b = bytearray(b)
+        if len(a) != len(b):
+            return False
+        result = 0
+        for (x, y) in zip(a, b):
+            result |= x ^ y
+        return result == 0
+
+# Stand-ins for the checksum and hash fields when verifying.
+zero_view = memoryview(bytes(bytearray(64)))
+
+
+def verify_hash(key, digest_index, data, hash_begin, hash_end):
+    '''Verify the HMAC of a received packet without modifying it
+
+    The hash is calculated the same way as the sender did, over the
+    packet with the checksum and hash fields zeroed, but the packet is
+    fed to the hash in pieces with zeros standing in for those fields.
+    Returns a (valid, calculated hash) tuple.
+    '''
+    if not isinstance(data, memoryview):
+        data = memoryview(data)
+    (inner, outer) = hmac_context(key, digest_index)
+    inner = inner.copy()
+    inner.update(data[0:2])
+    inner.update(zero_view[0:2])
+    inner.update(data[4:hash_begin])
+    inner.update(zero_view[0:(hash_end - hash_begin)])
+    inner.update(data[hash_end:])
+    outer = outer.copy()
+    outer.update(inner.digest())
+    calculated = bytearray(outer.digest())
+    return (compare_digest(calculated, data[hash_begin:hash_end]), calculated)
+
+
+def new_message_id(exclude=None):
+    '''Return a random message ID
+
+    If exclude (anything supporting "in", such as a dict of in-flight
+    message IDs) is given, the ID returned is not in it.  2ping always
+    passes its in-flight IDs: the check is one lookup per send, as a
+    collision is too unlikely for the loop to run again, so there is
+    nothing to be gained by making it optional.
+    '''
+    message_id = random_pool.read_uint48()
+    if exclude:
+        while message_id in exclude:
+            message_id = random_pool.read_uint48()
+    return message_id
+
+
+def message_id_sum(message_id):
+    '''Unfolded checksum word sum of a message ID at its header position'''
+    return (message_id >> 32) + ((message_id >> 16) & 0xffff) + (message_id & 0xffff)
+
+
+# Handler classes by opcode flag and by extended segment ID.  Use
+# register_opcode() / register_segment() to add to these.
+opcode_handlers = {}
+segment_handlers = {}
+
+
+def register_opcode(opcode_class):
+    '''Register an Opcode subclass as the handler for its flag
+
+    Returns the class, so this may also be used as a class decorator.
+    '''
+    if opcode_class.id not in opcode_flags_all:
+        raise Exception('Invalid opcode flag: %r' % opcode_class.id)
+    opcode_handlers[opcode_class.id] = opcode_class
+    return opcode_class
+
+
+def register_segment(segment_class):
+    '''Register an Extended subclass as the handler for its segment ID
+
+    Returns the class, so this may also be used as a class decorator.
+    '''
+    if (segment_class.id is None) or not (0 <= segment_class.id <= 0xffffffff):
+        raise Exception('Invalid extended segment ID: %r' % segment_class.id)
+    segment_handlers[segment_class.id] = segment_class
+    return segment_class
+
+
+for segment_class in (
+    ExtendedVersion,
+    ExtendedNotice,
+    ExtendedMonotonicClock,
+    ExtendedWallClock,
+    ExtendedRandom,
+):
+    register_segment(segment_class)
+
+for opcode_class in (
+    OpcodeReplyRequested,
+    OpcodeInReplyTo,
+    OpcodeRTTEnclosed,
+    OpcodeInvestigationSeen,
+    OpcodeInvestigationUnseen,
+    OpcodeInvestigate,
+    OpcodeCourtesyExpiration,
+    OpcodeHMAC,
+    OpcodeHostLatency,
+    OpcodeExtended,
+):
+    register_opcode(opcode_class)
+
+
+def load_segment(flag, data):
+    segment_handler = segment_handlers.get(flag)
+    if segment_handler is None:
+        # Unknown segments keep their ID on the instance.
+        segment = Extended()
+        segment.id = flag
+    else:
+        segment = segment_handler()
+    segment.load(data)
+    return segment
+
+
+def load_opcode(flag, data):
+    opcode_handler = opcode_handlers.get(flag)
+    if opcode_handler is None:
+        # Unknown opcodes keep their flag on the instance.
+        opcode = Opcode()
+        opcode.id = flag
+    else:
+        opcode = opcode_handler()
+    opcode.load(data)
+    return opcode
+
+
+# Repeated padding patterns, by pattern.
+padding_buffers = {}
+
+
+def padding(pattern, length, max_length=0):
+    '''Return length bytes of pattern, repeated, as a memoryview
+
+    The repeated pattern is built once per pattern, long enough for
+    max_length (normally the packet's max_length) and rebuilt only if a
+    longer padding is asked for.
+    '''
+    pattern = bytes(pattern)
+    try:
+        buf = padding_buffers[pattern]
+    except KeyError:
+        buf = None
+    if (buf is None) or (len(buf) < length):
+        size = max(length, max_length)
+        buf = padding_buffers[pattern] = memoryview(
+            (pattern * int(size / len(pattern) + 1))[0:size]
+        )
+    return buf[0:length]
+
+
+# Opcodes are given room in a packet in this order.
+opcode_priority = (
+    OpcodeHMAC.id,
+    OpcodeReplyRequested.id,
+    OpcodeInReplyTo.id,
+    OpcodeRTTEnclosed.id,
+    OpcodeInvestigationSeen.id,
+    OpcodeInvestigationUnseen.id,
+    OpcodeInvestigate.id,
+    OpcodeHostLatency.id,
+    OpcodeCourtesyExpiration.id,
+    OpcodeExtended.id,
+)
+
+
+class Packet(object):
+    __slots__ = (
+        'message_id', 'opcodes', 'min_length', 'max_length',
+        'padding_pattern', 'opcode_data_positions', 'template',
+    )
+
     def __repr__(self):
         return '<Packet (0x%s): %s>' % (
-            ''.join(['%02x' % x for x in self.message_id]),
+            ('%012x' % self.message_id) if self.message_id is not None else 'None',
             repr(sorted(self.opcodes.values(), key=lambda x: x.id))
         )
 
     def __init__(self):
-        self.message_id = bytearray()
+        self.message_id = None
         self.opcodes = {}
         self.min_length = 0
         self.max_length = 1024
         self.padding_pattern = bytearray(1)
         self.opcode_data_positions = {}
+        self.template = None
 
     def load(self, data):
-        magic_number = data[0:2]
-        if magic_number != bytearray((0x32, 0x50)):
+        if not isinstance(data, memoryview):
+            data = memoryview(data)
+        data_length = len(data)
+        if data_length < header_struct.size:
+            raise Exception('Truncated header')
+        (magic, packet_checksum, message_id_high, message_id_low, opcode_flags) = header_struct.unpack_from(data)
+        if magic != magic_number:
             raise Exception('Invalid magic number')
-        checksum = bytearray_to_int(data[2:4])
-        if checksum:
-            if twoping_checksum(data[0:2] + bytearray(2) + data[4:]) != checksum:
+        if packet_checksum:
+            # The sum of the whole packet includes the checksum field as
+            # one word, so take it back out rather than copying the packet
+            # with a zeroed field.
+            if checksum.finish(checksum.word_sum(data) - packet_checksum) != packet_checksum:
                 raise Exception('Invalid checksum')
-        self.message_id = data[4:10]
-        opcode_flags = bytearray_to_int(data[10:12])
-        self.opcodes = {}
+        self.message_id = (message_id_high << 32) | message_id_low
+        self.opcode_data_positions = {}
 
         pos = 12
-        known_opcodes = (
-            OpcodeReplyRequested,
-            OpcodeInReplyTo,
-            OpcodeRTTEnclosed,
-            OpcodeInvestigationSeen,
-            OpcodeInvestigationUnseen,
-            OpcodeInvestigate,
-            OpcodeCourtesyExpiration,
-            OpcodeHMAC,
-            OpcodeHostLatency,
-            OpcodeExtended,
-        )
-        for flag in (2 ** x for x in xrange(16)):
+        for flag in opcode_flags_all:
             if not opcode_flags & flag:
                 continue
-            opcode_data_length = bytearray_to_int(data[pos:pos+2])
+            if (pos + 2) > data_length:
+                raise Exception('Truncated opcode header')
+            opcode_data_length = opcode_header_struct.unpack_from(data, pos)[0]
             pos += 2
             self.opcode_data_positions[flag] = (pos, opcode_data_length)
-            opcode_handler = None
-            for oc in known_opcodes:
-                if flag == oc.id:
-                    opcode_handler = oc
-                    break
-            if opcode_handler is None:
-                opcode_handler = Opcode
-                opcode_handler.id = flag
-            self.opcodes[flag] = opcode_handler()
-            self.opcodes[flag].load(data[pos:(pos+opcode_data_length)])
             pos += opcode_data_length
-
-    def dump(self):
-        auth_pos_begin = 0
-        auth_pos_end = 0
-        if not self.message_id:
-            self.message_id = bytearray([random.randint(0, 255) for x in xrange(6)])
+        if pos > data_length:
+            raise Exception('Truncated opcode data')
+        # Opcodes are only decoded when looked up; a repr() decodes them all.
+        self.opcodes = LazyMap(data, self.opcode_data_positions, load_opcode)
+
+    def dump(self, manifest=False):
+        '''Serialize the packet
+
+        If manifest is True, a (data, PacketManifest) tuple is returned,
+        describing what actually made it into the packet.
+        '''
+        if self.template is not None:
+            return self.template.dump(self, manifest=manifest)
+        return self.serialize(manifest=manifest)
+
+    def dump_many(self, message_ids):
+        '''Serialize the packet once for each of message_ids
+
+        The packet is laid out once; the other buffers are copies with only
+        the message ID, the HMAC (if any) and the checksum rewritten.
+        Returns the buffers in the same order as message_ids, and leaves
+        message_id set to the last one.
+        '''
+        if not message_ids:
+            return []
+        self.message_id = message_ids[0]
+        (first, packet_manifest) = self.dump(manifest=True)
+        outs = [first]
+
+        # Zero out everything which differs between the buffers, so each
+        # buffer's checksum is the base sum plus the sums of those regions.
+        base = bytearray(first)
+        base[2:4] = bytearray(2)
+        base[4:10] = bytearray(6)
+        auth_pos = None
+        if OpcodeHMAC.id in packet_manifest.opcode_data_positions:
+            (pos, length) = packet_manifest.opcode_data_positions[OpcodeHMAC.id]
+            auth_pos = (pos + 2, pos + length)
+            base[auth_pos[0]:auth_pos[1]] = bytearray(length - 2)
+        base_sum = checksum.word_sum(base)
+
+        for message_id in message_ids[1:]:
+            out = bytearray(base)
+            pack_uint48_into(out, 4, message_id)
+            total = base_sum + message_id_sum(message_id)
+            if auth_pos is not None:
+                (auth_pos_begin, auth_pos_end) = auth_pos
+                auth_hash = self.calculate_hash(self.opcodes[OpcodeHMAC.id], out)
+                if len(auth_hash) != (auth_pos_end - auth_pos_begin):
+                    # The hash does not fill its opcode, so the packet
+                    # length changes; serialize it normally.
+                    self.message_id = message_id
+                    outs.append(self.dump())
+                    continue
+                out[auth_pos_begin:auth_pos_end] = auth_hash
+                total += checksum.word_sum(auth_hash, auth_pos_begin)
+            pack_uint16_into(out, 2, checksum.finish(total))
+            outs.append(out)
+        self.message_id = message_ids[-1]
+        return outs
+
+    def serialize(self, manifest=False):
+        if self.message_id is None:
+            self.message_id = new_message_id()
+
+        # Size the packet.  Opcodes are dumped in priority order, each
+        # limited to the room which is left.
         opcode_datas = {}
         packet_length = 12
-        for flag in (
-            OpcodeHMAC.id,
-            OpcodeReplyRequested.id,
-            OpcodeInReplyTo.id,
-            OpcodeRTTEnclosed.id,
-            OpcodeInvestigationSeen.id,
-            OpcodeInvestigationUnseen.id,
-            OpcodeInvestigate.id,
-            OpcodeHostLatency.id,
-            OpcodeCourtesyExpiration.id,
-            OpcodeExtended.id,
-        ):
+        max_length = self.max_length
+        for flag in opcode_priority:
             if flag not in self.opcodes:
                 continue
-            if (packet_length + 2) > self.max_length:
+            if (packet_length + 2) > max_length:
                 break
-            res = self.opcodes[flag].dump(max_length=(self.max_length - packet_length - 2))
+            res = self.opcodes[flag].dump(max_length=(max_length - packet_length - 2))
             if res is None:
                 continue
             opcode_datas[flag] = res
-            res_len = len(res)
-            packet_length += res_len + 2
+            packet_length += len(res) + 2
+
+        # Write everything into a single buffer, in flag order.
+        out = bytearray(max(packet_length, self.min_length))
         opcode_flags = 0
-        opcode_data = bytearray()
-        packet_length = 12
+        opcode_data_positions = {}
+        auth_pos_begin = 0
+        auth_pos_end = 0
+        pos = 12
         for flag in sorted(opcode_datas.keys()):
             res = opcode_datas[flag]
             res_len = len(res)
+            pack_uint16_into(out, pos, res_len)
+            pos += 2
+            out[pos:(pos+res_len)] = res
             if flag == OpcodeHMAC.id:
-                auth_pos_begin = packet_length + 4
-                auth_pos_end = auth_pos_begin + (res_len - 2)
+                auth_pos_begin = pos + 2
+                auth_pos_end = pos + res_len
+            opcode_data_positions[flag] = (pos, res_len)
             opcode_flags = opcode_flags | flag
-            opcode_data += int_to_bytearray(res_len, 2)
-            opcode_data += res
-            packet_length += res_len + 2
-        out = bytearray((0x32, 0x50)) + bytearray(2) + self.message_id + int_to_bytearray(opcode_flags, 2) + opcode_data
-        if len(out) < self.min_length:
-            target_padding = self.min_length - len(out)
-            padding = (self.padding_pattern * int(target_padding / len(self.padding_pattern) + 1))[0:target_padding]
-            out += padding
-        if (OpcodeHMAC.id in self.opcodes) and auth_pos_begin:
+            pos += res_len
+        header_struct.pack_into(
+            out, 0, magic_number, 0,
+            self.message_id >> 32, self.message_id & 0xffffffff, opcode_flags,
+        )
+        if pos < len(out):
+            out[pos:] = padding(self.padding_pattern, len(out) - pos, max_length)
+        if auth_pos_begin:
             out[auth_pos_begin:auth_pos_end] = self.calculate_hash(self.opcodes[OpcodeHMAC.id], out)
-        out[2:4] = int_to_bytearray(twoping_checksum(out), 2)
+        pack_uint16_into(out, 2, checksum.twoping_checksum(out))
+        if manifest:
+            return (out, PacketManifest(self, opcode_data_positions))
         return out
 
     def calculate_hash(self, opcode, payload):
-        (hasher, size) = opcode.digest_map[opcode.digest_index]
-        return bytearray(hmac.new(opcode.key, payload, hasher).digest())
+        return calculate_hash(opcode.key, opcode.digest_index, payload)
+
+
+class PacketManifest(object):
+    '''Layout of a serialized packet
+
+    opcode_data_positions maps each opcode flag which was emitted to its
+    (position, length) within the packet, the same as
+    Packet.opcode_data_positions after a load().  message_ids maps each
+    emitted ID list opcode to the message IDs which fit in the packet.
+    '''
+
+    __slots__ = ('opcode_flags', 'opcode_data_positions', 'message_ids')
+
+    def __init__(self, packet, opcode_data_positions):
+        self.opcode_flags = 0
+        self.opcode_data_positions = opcode_data_positions
+        self.message_ids = {}
+        for (flag, (pos, length)) in opcode_data_positions.items():
+            self.opcode_flags = self.opcode_flags | flag
+            opcode = packet.opcodes[flag]
+            if isinstance(opcode, OpcodeMessageIDList):
+                self.message_ids[flag] = opcode.message_ids[0:int((length - 2) / 6)]
+
+    def __repr__(self):
+        return '<PacketManifest: %s>' % repr(sorted(self.opcode_data_positions.items()))
+
+
+class PacketTemplate(object):
+    '''Pre-serialized outbound packet layouts
+
+    The opcodes of the template packet are assumed to serialize to the
+    same bytes for every packet created from the template, with the
+    exception of the Extended segments listed in dynamic_segments, which
+    must keep the same length.  The first packet of a given shape (set of
+    opcodes, their lengths and the final packet length) is serialized
+    normally and kept as a layout.  Later packets of the same shape copy
+    the layout and only write in the message ID, their own opcodes, the
+    dynamic segments, the HMAC and the checksum.
+    '''
+
+    def __init__(self, packet, dynamic_segments=()):
+        self.packet = packet
+        self.dynamic_segments = tuple(dynamic_segments)
+        self.layouts = {}
+        self.static_lengths = {}
+        for (flag, opcode) in packet.opcodes.items():
+            res = opcode.dump()
+            if res is None:
+                continue
+            self.static_lengths[flag] = len(res)
+
+    def new_packet(self):
+        packet = Packet()
+        packet.opcodes = dict(self.packet.opcodes)
+        packet.min_length = self.packet.min_length
+        packet.max_length = self.packet.max_length
+        packet.padding_pattern = self.packet.padding_pattern
+        packet.template = self
+        return packet
+
+    def dump(self, packet, manifest=False):
+        if packet.message_id is None:
+            packet.message_id = new_message_id()
+        opcode_datas = {}
+        shape = []
+        packet_length = 12
+        for flag in sorted(packet.opcodes.keys()):
+            opcode = packet.opcodes[flag]
+            if (flag in self.static_lengths) and (opcode is self.packet.opcodes[flag]):
+                res_len = self.static_lengths[flag]
+                shape.append((flag, res_len, False))
+            else:
+                res = opcode.dump()
+                if res is None:
+                    continue
+                opcode_datas[flag] = res
+                res_len = len(res)
+                shape.append((flag, res_len, True))
+            packet_length += res_len + 2
+        # Close to max_length, serialize() may truncate or drop opcodes (an
+        # empty ID list needs 8 bytes of room), so leave those to it.
+        if (packet_length + 6) > packet.max_length:
+            return packet.serialize(manifest=manifest)
+        shape = (tuple(shape), max(packet_length, packet.min_length))
+
+        if shape not in self.layouts:
+            res = packet.serialize(manifest=manifest)
+            out = res[0] if manifest else res
+            # A hash which does not fill its opcode changes the packet
+            # length; such packets are not worth a layout.
+            if len(out) == shape[1]:
+                self.layouts[shape] = self.new_layout(packet, shape, out)
+            return res
+        (layout, layout_sum, opcode_positions, opcode_data_positions, segment_positions, auth_pos) = self.layouts[shape]
+
+        # Every region written below is zero in the layout, so the
+        # checksum is the layout's sum plus the sums of the new regions.
+        out = bytearray(layout)
+        pack_uint48_into(out, 4, packet.message_id)
+        total = layout_sum + message_id_sum(packet.message_id)
+        for (flag, res) in opcode_datas.items():
+            pos = opcode_positions[flag]
+            out[pos:(pos+len(res))] = res
+            total += checksum.word_sum(res, pos)
+        if segment_positions:
+            segments = packet.opcodes[OpcodeExtended.id].segments
+            for (segment_id, pos, segment_data_length) in segment_positions:
+                if segment_id not in segments:
+                    return packet.serialize(manifest=manifest)
+                segment_data = segments[segment_id].dump()
+                if (segment_data is None) or (len(segment_data) != segment_data_length):
+                    return packet.serialize(manifest=manifest)
+                out[pos:(pos+segment_data_length)] = segment_data
+                total += checksum.word_sum(segment_data, pos)
+        if auth_pos is not None:
+            (auth_pos_begin, auth_pos_end) = auth_pos
+            auth_hash = packet.calculate_hash(packet.opcodes[OpcodeHMAC.id], out)
+            out[auth_pos_begin:auth_pos_end] = auth_hash
+            total += checksum.word_sum(auth_hash, auth_pos_begin)
+        pack_uint16_into(out, 2, checksum.finish(total))
+        if manifest:
+            return (out, PacketManifest(packet, opcode_data_positions))
+        return out
+
+    def new_layout(self, packet, shape, out):
+        layout = bytearray(out)
+        layout[2:4] = bytearray(2)
+        layout[4:10] = bytearray(6)
+        opcode_positions = {}
+        opcode_lengths = {}
+        opcode_data_positions = {}
+        pos = 12
+        for (flag, res_len, is_dynamic) in shape[0]:
+            opcode_positions[flag] = pos + 2
+            opcode_lengths[flag] = res_len
+            opcode_data_positions[flag] = (pos + 2, res_len)
+            if is_dynamic:
+                layout[(pos+2):(pos+2+res_len)] = bytearray(res_len)
+            pos += res_len + 2
+        auth_pos = None
+        if OpcodeHMAC.id in opcode_positions:
+            auth_pos_begin = opcode_positions[OpcodeHMAC.id] + 2
+            auth_pos_end = opcode_positions[OpcodeHMAC.id] + opcode_lengths[OpcodeHMAC.id]
+            layout[auth_pos_begin:auth_pos_end] = bytearray(auth_pos_end - auth_pos_begin)
+            auth_pos = (auth_pos_begin, auth_pos_end)
+        segment_positions = []
+        if (
+            (OpcodeExtended.id in self.static_lengths) and
+            (packet.opcodes.get(OpcodeExtended.id) is self.packet.opcodes[OpcodeExtended.id])
+        ):
+            extended = self.packet.opcodes[OpcodeExtended.id]
+            for segment_id in self.dynamic_segments:
+                if segment_id not in extended.segment_data_positions:
+                    continue
+                (pos, segment_data_length) = extended.segment_data_positions[segment_id]
+                pos += opcode_positions[OpcodeExtended.id]
+                layout[pos:(pos+segment_data_length)] = bytearray(segment_data_length)
+                segment_positions.append((segment_id, pos, segment_data_length))
+        return (layout, checksum.word_sum(layout), opcode_positions, opcode_data_positions, segment_positions, auth_pos)
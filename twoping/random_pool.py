@@ -0,0 +1,76 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# Buffered random bytes for message IDs and ExtendedRandom payloads.
+#
+# Random data is read from os.urandom() a block at a time and handed out
+# by slicing, so a message ID or a --send-random payload costs no
+# syscall.  If os.urandom() is not available, the block is filled from
+# the random module instead, and is_os is False.
+
+from __future__ import print_function, division
+import os
+import random
+import binascii
+from .codec import unpack_uint48
+
+
+class RandomPool():
+    def __init__(self, size=4096):
+        self.size = size
+        self.buf = bytearray()
+        self.pos = 0
+        try:
+            os.urandom(1)
+            self.is_os = True
+        except NotImplementedError:
+            self.is_os = False
+
+    def refill(self):
+        if self.is_os:
+            self.buf = bytearray(os.urandom(self.size))
+        else:
+            self.buf = bytearray(binascii.unhexlify('%0*x' % (self.size * 2, random.getrandbits(self.size * 8))))
+        self.pos = 0
+
+    def reset(self):
+        '''Discard the buffered data, e.g. after a fork()'''
+        self.buf = bytearray()
+        self.pos = 0
+
+    def read(self, length):
+        if length > self.size:
+            out = bytearray()
+            while len(out) < length:
+                out += self.read(min(self.size, length - len(out)))
+            return out
+        if (self.pos + length) > len(self.buf):
+            self.refill()
+        out = self.buf[self.pos:(self.pos + length)]
+        self.pos += length
+        return out
+
+    def read_uint48(self):
+        if (self.pos + 6) > len(self.buf):
+            self.refill()
+        out = unpack_uint48(self.buf, self.pos)
+        self.pos += 6
+        return out
+
+
+pool = RandomPool()
@@ -0,0 +1,89 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# Timer scheduler for TwoPing.loop().
+#
+# A binary heap of [time, sequence, key] entries, where a key is any
+# hashable object (a SocketClass for its next send, or a name such as
+# 'cleanup').  Each key has at most one pending time.  Rescheduling or
+# cancelling a key marks its old entry as removed rather than searching
+# the heap for it; removed entries are dropped when they reach the top,
+# and the heap is rebuilt if they come to outnumber the live ones.
+
+import heapq
+import itertools
+
+removed = object()
+
+
+class Scheduler():
+    def __init__(self):
+        self.heap = []
+        # Live heap entries, by key.
+        self.entries = {}
+        # Breaks ties between equal times, so keys are never compared.
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, when):
+        '''Schedule key for when, replacing any time already pending for it'''
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == when:
+                return
+            entry[2] = removed
+        entry = [when, next(self.counter), key]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        if len(self.heap) > (len(self.entries) * 2 + 64):
+            self.compact()
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[2] = removed
+
+    def compact(self):
+        self.heap = [entry for entry in self.heap if entry[2] is not removed]
+        heapq.heapify(self.heap)
+
+    def peek(self):
+        '''Return (time, key) of the earliest pending key, or None'''
+        heap = self.heap
+        while heap and (heap[0][2] is removed):
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return (heap[0][0], heap[0][2])
+
+    def pop_due(self, now):
+        '''Remove and return the keys due at or before now, earliest first'''
+        heap = self.heap
+        due = []
+        while heap and (heap[0][0] <= now):
+            key = heapq.heappop(heap)[2]
+            if key is removed:
+                continue
+            del(self.entries[key])
+            due.append(key)
+        return due
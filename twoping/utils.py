@@ -19,31 +19,13 @@
 from __future__ import print_function, division
 import platform
 import gettext
+from .checksum import twoping_checksum
 
 
 _ = gettext.translation('2ping', fallback=True).ugettext
 _pl = gettext.translation('2ping', fallback=True).ungettext
 
 
-def twoping_checksum(d):
-    checksum = 0
-
-    for i in xrange(len(d)):
-        if i & 1:
-            checksum += d[i]
-        else:
-            checksum += d[i] << 8
-
-    checksum = ((checksum >> 16) + (checksum & 0xffff))
-    checksum = ((checksum >> 16) + (checksum & 0xffff))
-    checksum = ~checksum & 0xffff
-
-    if checksum == 0:
-        checksum = 0xffff
-
-    return checksum
-
-
 def lazy_div(n, d):
     if d == 0:
         return 0
@@ -0,0 +1,317 @@
+# 2ping - A bi-directional ping utility
+# Copyright (C) 2015 Ryan Finnie
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+# Multi-process listener (--listen --workers=N).
+#
+# The supervisor binds one set of listener sockets per worker, all with
+# SO_REUSEPORT, so the kernel hashes each peer to one worker's sockets.
+# It then forks a worker for each set, which runs the normal listener
+# with its own state.  The supervisor keeps every set open, so a worker
+# which dies is restarted on the same sockets and no peer moves to a
+# different worker.
+#
+# Workers report their statistics over a pipe, one JSON object per
+# line: a snapshot when the supervisor sends SIGUSR1 (for SIGQUIT and
+# --stats), and a final report when told to stop with SIGTERM.  The
+# supervisor merges them into its own TwoPing instance for printing.
+
+from __future__ import print_function, division
+import os
+import sys
+import json
+import random
+import select
+import signal
+import socket
+import errno
+import traceback
+from . import best_poller
+from . import fuzz
+from . import monotonic_clock
+from .random_pool import pool as random_pool
+from .utils import _, lazy_div
+
+clock = monotonic_clock.clock
+
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', None)
+if (SO_REUSEPORT is None) and sys.platform.startswith('linux'):
+    # Not exported by Python 2's socket module.
+    SO_REUSEPORT = 15
+
+has_workers = hasattr(os, 'fork') and (SO_REUSEPORT is not None)
+
+# TwoPing statistics which are merged by adding them up.
+summed_stats = (
+    'pings_transmitted', 'pings_received', 'packets_transmitted', 'packets_received',
+    'lost_outbound', 'lost_inbound', 'errors_received', 'rtt_total', 'rtt_total_sq', 'rtt_count',
+    'recv_batches', 'recv_batch_datagrams', 'send_batches', 'send_batch_datagrams',
+)
+
+
+def collect_stats(twoping):
+    stats = {}
+    for name in summed_stats + ('rtt_min', 'rtt_max', 'rtt_ewma', 'parse_failures'):
+        stats[name] = getattr(twoping, name)
+    return stats
+
+
+def merge_stats(twoping, all_stats):
+    '''Set the statistics of twoping to the combination of all_stats'''
+    for name in summed_stats:
+        setattr(twoping, name, sum(stats[name] for stats in all_stats))
+    twoping.rtt_min = min([stats['rtt_min'] for stats in all_stats if stats['rtt_min']] or [0])
+    twoping.rtt_max = max([stats['rtt_max'] for stats in all_stats] or [0])
+    # An EWMA can't be combined exactly; weight each by its sample count.
+    twoping.rtt_ewma = lazy_div(sum(stats['rtt_ewma'] * stats['rtt_count'] for stats in all_stats), twoping.rtt_count)
+    twoping.parse_failures = {}
+    for stats in all_stats:
+        for (failure, count) in stats['parse_failures'].items():
+            twoping.parse_failures[failure] = twoping.parse_failures.get(failure, 0) + count
+
+
+class WorkerProcess():
+    def __init__(self, index, pid, fd):
+        self.index = index
+        self.pid = pid
+        self.fd = fd
+        self.buf = b''
+        self.stats = None
+        self.snapshots = 0
+
+
+class StopWorker(BaseException):
+    '''Raised by the SIGTERM handler
+
+    Not an Exception, so the per-packet error handling in
+    process_incoming_datagrams() lets it through.
+    '''
+
+
+class Supervisor():
+    def __init__(self, twoping):
+        self.twoping = twoping
+        self.args = twoping.args
+        self.sock_sets = []
+        # Running workers, by index.
+        self.workers = {}
+        # Last statistics of workers which have exited.
+        self.retired = []
+        # Earliest restart time of exited workers, by index.
+        self.restarts = {}
+        self.shutting_down = False
+        self.want_stats = False
+
+    def run(self):
+        t = self.twoping
+        try:
+            for i in range(self.args.workers):
+                self.sock_sets.append(t.listener_sockets(announce=(i == 0)))
+        except (socket.error, socket.gaierror) as e:
+            t.print_out(str(e))
+            return 1
+
+        if hasattr(signal, 'SIGQUIT'):
+            signal.signal(signal.SIGQUIT, self.sigquit_handler)
+        signal.signal(signal.SIGTERM, self.sigterm_handler)
+        for i in range(self.args.workers):
+            self.start_worker(i)
+        try:
+            self.loop()
+        except (KeyboardInterrupt, StopWorker):
+            pass
+        self.stop_workers()
+        merge_stats(t, self.retired)
+        t.shutdown()
+
+    def sigquit_handler(self, signum, frame):
+        self.want_stats = True
+
+    def sigterm_handler(self, signum, frame):
+        raise StopWorker()
+
+    def start_worker(self, index):
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.run_worker(index, write_fd)
+        os.close(write_fd)
+        self.workers[index] = WorkerProcess(index, pid, read_fd)
+        self.restarts[index] = clock() + 1.0
+        self.twoping.print_debug('Worker %d: pid %d' % (index, pid))
+
+    def run_worker(self, index, fd):
+        '''Run the listener for sock_sets[index]; never returns'''
+        status = 0
+        try:
+            t = self.twoping
+            for worker in self.workers.values():
+                os.close(worker.fd)
+            for (i, socks) in enumerate(self.sock_sets):
+                if i != index:
+                    for sock in socks:
+                        sock.close()
+            self.reseed_worker(index)
+            # Keep output lines from different workers whole.
+            sys.stdout = os.fdopen(os.dup(sys.stdout.fileno()), 'w', 1)
+
+            if hasattr(signal, 'SIGQUIT'):
+                signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.report(fd, 'snapshot'))
+            signal.signal(signal.SIGTERM, self.sigterm_handler)
+
+            # The supervisor handles --stats and --deadline.
+            t.args.stats = None
+            t.args.deadline = None
+            t.poller = best_poller.best_poller()
+            t.sock_classes = []
+            t.setup_listener(self.sock_sets[index])
+            engine = t.new_engine()
+            try:
+                if engine is not None:
+                    engine.run()
+                else:
+                    t.loop()
+            except (KeyboardInterrupt, SystemExit, StopWorker):
+                pass
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            self.report(fd, 'final')
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def reseed_worker(self, index):
+        '''Don't share random state with the supervisor or other workers'''
+        t = self.twoping
+        random_pool.reset()
+        random.seed()
+        if t.fuzzer is not None:
+            # Offset from the seed the supervisor reports, so each worker
+            # fuzzes differently and the run can still be replayed.
+            t.fuzzer = fuzz.Fuzzer(t.fuzzer.seed + index)
+
+    def report(self, fd, report_type):
+        data = json.dumps({'type': report_type, 'stats': collect_stats(self.twoping)}) + '\n'
+        while data:
+            data = data[os.write(fd, data):]
+
+    def loop(self):
+        t = self.twoping
+        while True:
+            now = clock()
+            if self.args.deadline:
+                time_deadline = t.time_start + self.args.deadline
+                if now >= time_deadline:
+                    return
+            if self.want_stats or (self.args.stats and (now >= t.next_stats)):
+                self.want_stats = False
+                self.print_stats_short()
+                if self.args.stats:
+                    t.next_stats = now + self.args.stats
+
+            for index in range(self.args.workers):
+                if (index not in self.workers) and (now >= self.restarts[index]):
+                    self.start_worker(index)
+
+            next_wakeup = now + 1.0
+            if self.args.stats and (t.next_stats < next_wakeup):
+                next_wakeup = t.next_stats
+            if self.args.deadline and (time_deadline < next_wakeup):
+                next_wakeup = time_deadline
+            self.read_workers(max(next_wakeup - now, 0))
+
+    def read_workers(self, timeout):
+        fds = dict((worker.fd, worker) for worker in self.workers.values())
+        try:
+            readable = select.select(fds.keys(), [], [], timeout)[0]
+        except (select.error, IOError, OSError) as e:
+            if e.args[0] not in (errno.EINTR,):
+                raise
+            return
+        for fd in readable:
+            worker = fds[fd]
+            data = os.read(fd, 65536)
+            if not data:
+                self.reap_worker(worker)
+                continue
+            worker.buf += data
+            while b'\n' in worker.buf:
+                (line, worker.buf) = worker.buf.split(b'\n', 1)
+                message = json.loads(line)
+                worker.stats = message['stats']
+                if message['type'] == 'snapshot':
+                    worker.snapshots += 1
+
+    def reap_worker(self, worker):
+        os.close(worker.fd)
+        (pid, status) = os.waitpid(worker.pid, 0)
+        del(self.workers[worker.index])
+        if worker.stats is not None:
+            self.retired.append(worker.stats)
+        if self.shutting_down:
+            return
+        self.twoping.print_out(_('Worker {worker} (pid {pid}) exited with status {status}, restarting').format(
+            worker=worker.index,
+            pid=worker.pid,
+            status=status,
+        ))
+
+    def print_stats_short(self):
+        # Ask every worker for a snapshot, and give them a second to answer.
+        t = self.twoping
+        waiting = {}
+        for worker in self.workers.values():
+            try:
+                os.kill(worker.pid, signal.SIGUSR1)
+            except OSError:
+                continue
+            waiting[worker.index] = worker.snapshots
+        deadline = clock() + 1.0
+        while clock() < deadline:
+            for index in list(waiting.keys()):
+                if (index not in self.workers) or (self.workers[index].snapshots > waiting[index]):
+                    del(waiting[index])
+            if not waiting:
+                break
+            self.read_workers(deadline - clock())
+        merge_stats(t, self.retired + [worker.stats for worker in self.workers.values() if worker.stats is not None])
+        t.print_stats(short=True)
+
+    def stop_workers(self):
+        self.shutting_down = True
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for worker in self.workers.values():
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        deadline = clock() + 5.0
+        while self.workers and (clock() < deadline):
+            self.read_workers(deadline - clock())
+        for worker in list(self.workers.values()):
+            try:
+                os.kill(worker.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.reap_worker(worker)